@@ -0,0 +1,65 @@
+"""Measures the per-call overhead that Model.predict adds on top of the
+underlying torchvision model when predicting on single small images.
+
+Usage::
+
+    python benchmarks/predict_overhead.py --size 64 --calls 200
+
+The model's forward pass is timed on its own, on already preprocessed
+tensors, and compared with full calls to Model.predict on the raw
+images. The difference is the time spent in detecto's preprocessing,
+mode switching and output handling.
+"""
+
+import argparse
+import numpy as np
+import statistics
+import time
+import torch
+
+from detecto.core import Model
+
+
+def time_calls(fn, calls):
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--model-name', default=Model.MOBILENET_320, help='the Faster R-CNN architecture to use')
+    parser.add_argument('--size', type=int, default=64, help='height and width of the images')
+    parser.add_argument('--calls', type=int, default=200, help='number of timed calls')
+    parser.add_argument('--threads', type=int, default=1, help='number of threads PyTorch uses')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = Model(['a', 'b'], device=torch.device('cpu'), pretrained=False, model_name=args.model_name)
+    image = np.random.randint(0, 255, (args.size, args.size, 3), dtype=np.uint8)
+
+    internal = model.get_internal_model().eval()
+    tensor = model._preprocess([image])
+
+    def forward():
+        with torch.inference_mode():
+            internal(tensor)
+
+    # Warm up both paths before timing them
+    for _ in range(5):
+        forward()
+        model.predict(image)
+
+    forward_time = time_calls(forward, args.calls)
+    predict_time = time_calls(lambda: model.predict(image), args.calls)
+
+    print('forward only:     {:8.3f} ms'.format(forward_time * 1000))
+    print('Model.predict:    {:8.3f} ms'.format(predict_time * 1000))
+    print('per-call overhead: {:7.3f} ms'.format((predict_time - forward_time) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Compares the latency and accuracy of a quantized model against the
+original float model on the CPU.
+
+Usage::
+
+    python benchmarks/quantization.py model_weights.pth labels.csv images/ --classes cat dog
+
+The dataset is split at random into the images used to calibrate the
+quantized model and the images both models are evaluated on, so the
+calibration images never count towards the accuracy numbers.
+
+Accuracy is measured as the precision and recall of each model's
+predictions against the dataset's labels, where a prediction counts as
+correct if it has the right label and an IoU of at least 0.5 with a
+labeled box that no other prediction has already matched.
+"""
+
+import argparse
+import copy
+import random
+import statistics
+import time
+import torch
+
+from detecto.core import Dataset, Model
+from torchvision.ops import box_iou
+
+
+def evaluate(model, dataset, indices, score_threshold, runs):
+    latencies = []
+    true_positives = num_predictions = num_labels = 0
+
+    for idx in indices:
+        # Predict on the raw image, leaving preprocessing to the model
+        image = dataset._load_image(idx)
+        _, target = dataset[idx]
+
+        for _ in range(runs):
+            start = time.perf_counter()
+            labels, boxes, scores = model.predict(image)
+            latencies.append(time.perf_counter() - start)
+
+        keep = scores >= score_threshold
+        labels = [label for label, k in zip(labels, keep) if k]
+        boxes = boxes[keep]
+
+        num_predictions += len(labels)
+        num_labels += len(target['labels'])
+
+        # Greedily match predictions (in order of score) to labeled boxes
+        matched = set()
+        ious = box_iou(boxes, target['boxes'].float()) if len(labels) > 0 else None
+        for i, label in enumerate(labels):
+            for j, target_label in enumerate(target['labels']):
+                if j not in matched and label == target_label and ious[i, j] >= 0.5:
+                    matched.add(j)
+                    true_positives += 1
+                    break
+
+    precision = true_positives / num_predictions if num_predictions else 0.0
+    recall = true_positives / num_labels if num_labels else 0.0
+    return statistics.median(latencies), precision, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('weights', help='path to the .pth file of model weights')
+    parser.add_argument('label_data', help='label data to evaluate on, as given to detecto.core.Dataset')
+    parser.add_argument('image_folder', nargs='?', help='folder of images, as given to detecto.core.Dataset')
+    parser.add_argument('--classes', nargs='+', required=True, help='the classes the model was trained on')
+    parser.add_argument('--model-name', default=Model.DEFAULT, help='the Faster R-CNN architecture of the weights')
+    parser.add_argument('--calibration-images', type=int, default=100,
+                        help='number of images to calibrate with; 0 only quantizes the box head')
+    parser.add_argument('--score-threshold', type=float, default=0.5, help='minimum score of counted predictions')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for splitting off the calibration images')
+    parser.add_argument('--runs', type=int, default=3, help='number of timed predictions per image')
+    args = parser.parse_args()
+
+    dataset = Dataset(args.label_data, args.image_folder)
+    model = Model.load(args.weights, args.classes, model_name=args.model_name, device=torch.device('cpu'))
+
+    # Hold out the calibration images from the evaluation
+    indices = list(range(len(dataset)))
+    random.Random(args.seed).shuffle(indices)
+    calibration_indices, evaluation_indices = indices[:args.calibration_images], indices[args.calibration_images:]
+    if len(evaluation_indices) == 0:
+        parser.error(f'the dataset only has {len(dataset)} images, leaving none to evaluate on after calibration')
+
+    quantized = copy.deepcopy(model)
+    # Raw images, so that the model preprocesses them the same way as when predicting
+    calibration_data = [dataset._load_image(idx) for idx in calibration_indices] or None
+    quantized.quantize(calibration_data, num_calibration_images=args.calibration_images)
+
+    results = {}
+    for name, m in [('float', model), ('quantized', quantized)]:
+        results[name] = evaluate(m, dataset, evaluation_indices, args.score_threshold, args.runs)
+
+    print('{:<10} {:>12} {:>10} {:>10}'.format('model', 'latency (ms)', 'precision', 'recall'))
+    for name, (latency, precision, recall) in results.items():
+        print('{:<10} {:>12.1f} {:>10.3f} {:>10.3f}'.format(name, latency * 1000, precision, recall))
+
+    (float_latency, float_precision, float_recall) = results['float']
+    (quant_latency, quant_precision, quant_recall) = results['quantized']
+    print('{:<10} {:>11.1f}% {:>+10.3f} {:>+10.3f}'.format(
+        'delta', (quant_latency / float_latency - 1) * 100, quant_precision - float_precision, quant_recall - float_recall))
+
+
+if __name__ == '__main__':
+    main()
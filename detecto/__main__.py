@@ -0,0 +1,3 @@
+from detecto.cli import main
+
+main()
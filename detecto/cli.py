@@ -0,0 +1,59 @@
+import argparse
+import torch
+
+from detecto.core import Model
+from detecto.server import serve
+
+
+def main(args=None):
+    """The entry point of the ``detecto`` command. Currently supports a
+    single subcommand, ``detecto serve``, which serves a model over HTTP
+    with :func:`detecto.server.serve`. Run ``detecto serve --help`` for
+    its options.
+
+    :param args: (Optional) The command line arguments to parse. Defaults
+        to None, in which case ``sys.argv`` is used.
+    :type args: list or None
+
+    **Example**::
+
+        $ detecto serve model_weights.pth --classes cat dog --port 8080 --max-batch-size 16
+    """
+
+    parser = argparse.ArgumentParser(prog='detecto')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Serve a model over HTTP')
+    serve_parser.add_argument('weights', nargs='?', default=None,
+                              help='Saved weights (.pth), a TorchScript model (with --scripted) or an ONNX model '
+                                   '(.onnx). Defaults to the model pre-trained on COCO.')
+    serve_parser.add_argument('--classes', nargs='+', default=None, help="The model's classes")
+    serve_parser.add_argument('--scripted', action='store_true', help='Load the weights as a TorchScript model')
+    serve_parser.add_argument('--model-name', default=Model.DEFAULT,
+                              choices=[Model.DEFAULT, Model.MOBILENET, Model.MOBILENET_320])
+    serve_parser.add_argument('--preset', default=None, choices=[Model.FAST, Model.BALANCED, Model.ACCURATE])
+    serve_parser.add_argument('--device', default=None, help="e.g. 'cpu' or 'cuda'")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--max-batch-size', type=int, default=8)
+    serve_parser.add_argument('--max-wait', type=float, default=0.005,
+                              help='Seconds to wait for more requests before predicting on a batch')
+    serve_parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    args = parser.parse_args(args)
+    serve(_load_model(args), args.host, args.port, args.max_batch_size, args.max_wait, args.verbose)
+
+
+# Loads the model described by the parsed command line arguments
+def _load_model(args):
+    device = torch.device(args.device) if args.device else None
+
+    if args.weights is None:
+        return Model(device=device, model_name=args.model_name, preset=args.preset)
+    if args.weights.endswith('.onnx'):
+        return Model.load_onnx(args.weights, classes=args.classes)
+    if args.scripted:
+        return Model.load_scripted(args.weights, classes=args.classes, device=device)
+    if args.classes is None:
+        raise SystemExit('detecto serve: --classes is required to load saved weights')
+    return Model.load(args.weights, args.classes, model_name=args.model_name, device=device, preset=args.preset)
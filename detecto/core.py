@@ -1,13 +1,23 @@
+import cv2
+import inspect
+import json
+import numpy as np
 import os
 import pandas as pd
 import random
 import torch
 import torchvision
 
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from detecto.config import config
-from detecto.utils import default_transforms, filter_top_predictions, xml_to_csv, _is_iterable, read_image
+from detecto.utils import default_transforms, filter_top_predictions, filter_top_predictions_batch, xml_to_csv, \
+    _is_iterable, read_image, _get_aspect_ratio, _read_labels, _run_pipeline
+from functools import partial
+from itertools import islice
 from torchvision import transforms
 from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
+from torchvision.models.detection.generalized_rcnn import GeneralizedRCNN
 from tqdm import tqdm
 
 
@@ -57,7 +67,11 @@ class DataLoader(torch.utils.data.DataLoader):
 
 class Dataset(torch.utils.data.Dataset):
 
-    def __init__(self, label_data, image_folder=None, transform=None):
+    # Kinds of transforms that also need to be applied to the boxes
+    _FLIP = 'flip'
+    _RESIZE = 'resize'
+
+    def __init__(self, label_data, image_folder=None, transform=None, cache_size=0):
         """Takes in the path to the label data and images and creates
         an indexable dataset over all of the data. Applies optional
         transforms over the data. Extends PyTorch's `Dataset
@@ -67,9 +81,11 @@ class Dataset(torch.utils.data.Dataset):
             the XML label files or a CSV file containing the label data.
             If a CSV file, the file should have the following columns in
             order: ``filename``, ``width``, ``height``, ``class``, ``xmin``,
-            ``ymin``, ``xmax``, ``ymax`` and ``image_id``. See
-            :func:`detecto.utils.xml_to_csv` to generate CSV files in this
-            format from XML label files.
+            ``ymin``, ``xmax``, ``ymax`` and ``image_id``. Parquet (.parquet)
+            and Feather (.feather) files with the same columns are also
+            accepted and load much faster than CSV files. See
+            :func:`detecto.utils.xml_to_csv` to generate files in these
+            formats from XML label files.
         :type label_data: str
         :param image_folder: (Optional) The path to the folder containing the
             images. If not specified, it is assumed that the images and XML
@@ -82,11 +98,21 @@ class Dataset(torch.utils.data.Dataset):
             the dataset. See `PyTorch docs
             <https://pytorch.org/docs/stable/torchvision/transforms.html>`_
             for a list of possible transforms. When using transforms.Resize
-            and transforms.RandomHorizontalFlip, all box coordinates are
+            (with either an int or a ``(height, width)`` tuple size) and
+            transforms.RandomHorizontalFlip, all box coordinates are
             automatically adjusted to match the modified image. If None,
             defaults to the transforms returned by
             :func:`detecto.utils.default_transforms`.
         :type transform: torchvision.transforms.Compose or None
+        :param cache_size: (Optional) The maximum number of bytes of decoded
+            images to keep in memory so that each image file only needs to
+            be read from disk once. When the cache is full, the least
+            recently used images are evicted. Images are cached before any
+            transforms are applied. Note that each worker process of a
+            :class:`detecto.core.DataLoader` keeps its own cache. See
+            :meth:`detecto.core.Dataset.cache_info` for cache statistics.
+            Defaults to 0, in which case no images are cached.
+        :type cache_size: int
 
         **Indexing**:
 
@@ -121,7 +147,7 @@ class Dataset(torch.utils.data.Dataset):
 
         # CSV file contains: filename, width, height, class, xmin, ymin, xmax, ymax
         if os.path.isfile(label_data):
-            self._csv = pd.read_csv(label_data)
+            self._csv = _read_labels(label_data)
         else:
             self._csv = xml_to_csv(label_data)
 
@@ -136,10 +162,36 @@ class Dataset(torch.utils.data.Dataset):
         else:
             self.transform = transform
 
+        self._cache = _ImageCache(cache_size) if cache_size > 0 else None
+
+        self._build_index()
+
+    # Builds compact per-image arrays from the label data so that indexing
+    # the dataset never has to scan or touch the DataFrame
+    def _build_index(self):
+        # Sort by image_id (stable, so objects keep their original order)
+        # so that the objects of each image occupy a contiguous block
+        csv = self._csv.sort_values('image_id', kind='stable')
+
+        image_ids = csv['image_id'].to_numpy()
+        self._image_ids, starts = np.unique(image_ids, return_index=True)
+        # offsets[i]:offsets[i + 1] are the rows belonging to the ith image
+        self._offsets = np.append(starts, len(image_ids))
+
+        self._filenames = csv['filename'].to_numpy()[starts]
+        self._widths = csv['width'].to_numpy()[starts]
+        self._heights = csv['height'].to_numpy()[starts]
+
+        self._boxes = np.ascontiguousarray(csv[['xmin', 'ymin', 'xmax', 'ymax']].to_numpy(dtype=np.int64))
+        # Integer-coded labels; self._label_names[code] gives back the string
+        codes, names = pd.factorize(csv['class'])
+        self._label_codes = codes.astype(np.int32)
+        self._label_names = list(names)
+
     # Returns the length of this dataset
     def __len__(self):
-        # number of entries == number of unique image_ids in csv.
-        return len(self._csv['image_id'].unique().tolist())
+        # number of entries == number of unique image_ids in the label data
+        return len(self._image_ids)
 
     # Is what allows you to index the dataset, e.g. dataset[0]
     # dataset[index] returns a tuple containing the image and the targets dict
@@ -147,75 +199,300 @@ class Dataset(torch.utils.data.Dataset):
         if torch.is_tensor(idx):
             idx = idx.tolist()
 
-        # Read in the image from the file name in the 0th column
-        object_entries = self._csv.loc[self._csv['image_id'] == idx]
+        start, end = self._offsets[idx], self._offsets[idx + 1]
 
-        img_name = os.path.join(self._root_dir, object_entries.iloc[0, 0])
-        image = read_image(img_name)
+        image = self._load_image(idx)
 
-        boxes = []
-        labels = []
-        for object_idx, row in object_entries.iterrows():
-            # Read in xmin, ymin, xmax, and ymax
-            box = self._csv.iloc[object_idx, 4:8]
-            boxes.append(box)
-            # Read in the labe
-            label = self._csv.iloc[object_idx, 3]
-            labels.append(label)
-
-        boxes = torch.tensor(boxes).view(-1, 4)
-
-        targets = {'boxes': boxes, 'labels': labels}
+        boxes = torch.tensor(self._boxes[start:end]).view(-1, 4)
+        labels = [self._label_names[code] for code in self._label_codes[start:end]]
 
         # Perform transformations
         if self.transform:
-            width = object_entries.iloc[0, 1]
-            height = object_entries.iloc[0, 2]
-
-            # Apply the transforms manually to be able to deal with
-            # transforms like Resize or RandomHorizontalFlip
-            updated_transforms = []
-            scale_factor = 1.0
-            random_flip = 0.0
-            for t in self.transform.transforms:
-                # Add each transformation to our list
-                updated_transforms.append(t)
-
-                # If a resize transformation exists, scale down the coordinates
-                # of the box by the same amount as the resize
-                if isinstance(t, transforms.Resize):
-                    original_size = min(height, width)
-                    scale_factor = original_size / t.size
-
-                # If a horizontal flip transformation exists, get its probability
-                # so we can apply it manually to both the image and the boxes.
-                elif isinstance(t, transforms.RandomHorizontalFlip):
-                    random_flip = t.p
-
-            # Apply each transformation manually
-            for t in updated_transforms:
-                # Handle the horizontal flip case, where we need to apply
-                # the transformation to both the image and the box labels
-                if isinstance(t, transforms.RandomHorizontalFlip):
-                    if random.random() < random_flip:
-                        image = transforms.RandomHorizontalFlip(1)(image)
-                        for idx, box in enumerate(targets['boxes']):
-                            # Flip box's x-coordinates
-                            box[0] = width - box[0]
-                            box[2] = width - box[2]
-                            box[[0,2]] = box[[2,0]]
-                            targets['boxes'][idx] = box
-                else:
-                    image = t(image)
-
-            # Scale down box if necessary
-            if scale_factor != 1.0:
-                for idx, box in enumerate(targets['boxes']):
-                    box = (box / scale_factor).long()
-                    targets['boxes'][idx] = box
+            image, boxes = self._apply_transforms(image, boxes, self._widths[idx], self._heights[idx])
+
+        targets = {'boxes': boxes, 'labels': labels}
 
         return image, targets
 
+    def cache_info(self):
+        """Returns statistics on the dataset's cache of decoded images.
+
+        :return: A dict with the keys ``hits`` and ``misses``, giving the
+            number of image reads that were and weren't served from the
+            cache, ``size``, the number of bytes currently cached,
+            ``max_size``, the cache's memory budget in bytes, and
+            ``entries``, the number of images currently cached. All
+            values are 0 if caching is disabled.
+        :rtype: dict
+
+        **Example**::
+
+            >>> from detecto.core import Dataset
+
+            >>> dataset = Dataset('labels.csv', 'images/', cache_size=2 * 1024 ** 3)
+            >>> for image, target in dataset:
+            >>>     pass
+            >>> for image, target in dataset:
+            >>>     pass
+            >>> dataset.cache_info()
+            {'hits': 100, 'misses': 100, 'size': 276480000, 'max_size': 2147483648, 'entries': 100}
+        """
+
+        if self._cache is None:
+            return {'hits': 0, 'misses': 0, 'size': 0, 'max_size': 0, 'entries': 0}
+        return self._cache.info()
+
+    def export_shards(self, path, size=None, shard_size=1 << 30):
+        """Decodes every image in the dataset and writes them, along with
+        their boxes and labels, into a folder of large binary shard files
+        that can be loaded with :class:`detecto.core.ShardedDataset`.
+        Images are stored as raw uint8 RGB pixels before any of the
+        dataset's transforms are applied, so reading them back requires
+        no decoding and only sequential reads from disk.
+
+        :param path: The path to the folder in which to save the shards.
+            It is created if it doesn't already exist.
+        :type path: str
+        :param size: (Optional) If given, resizes each image (and its
+            boxes) before saving it, with the same semantics as
+            transforms.Resize: an int matches the shorter edge of the
+            image to it and a ``(height, width)`` tuple sets the exact
+            output size. Defaults to None, in which case images are saved
+            at their original size.
+        :type size: int or tuple or None
+        :param shard_size: (Optional) The maximum number of bytes of image
+            data to store in each shard file. Images bigger than this get
+            a shard to themselves. Defaults to 1 GiB.
+        :type shard_size: int
+
+        **Example**::
+
+            >>> from detecto.core import Dataset, ShardedDataset
+
+            >>> dataset = Dataset('labels.csv', 'images/')
+            >>> dataset.export_shards('shards/', size=800)
+            >>> sharded_dataset = ShardedDataset('shards/')
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        shards = np.zeros(len(self), dtype=np.int32)
+        offsets = np.zeros(len(self), dtype=np.int64)
+        widths = np.zeros(len(self), dtype=np.int32)
+        heights = np.zeros(len(self), dtype=np.int32)
+        boxes = []
+
+        shard, shard_bytes = 0, 0
+        file = open(os.path.join(path, ShardedDataset.SHARD_FILE.format(shard)), 'wb')
+        try:
+            for idx in range(len(self)):
+                image = self._load_image(idx)
+                image_boxes = self._boxes[self._offsets[idx]:self._offsets[idx + 1]]
+
+                if size is not None:
+                    height, width = image.shape[:2]
+                    new_width, new_height, factor_x, factor_y = self._get_resize_factors(size, width, height)
+                    image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+                    scale = np.array([factor_x, factor_y, factor_x, factor_y])
+                    image_boxes = (image_boxes / scale).astype(np.int64)
+
+                image = np.ascontiguousarray(image, dtype=np.uint8)
+
+                # Start a new shard once the current one is full
+                if shard_bytes > 0 and shard_bytes + image.nbytes > shard_size:
+                    file.close()
+                    shard, shard_bytes = shard + 1, 0
+                    file = open(os.path.join(path, ShardedDataset.SHARD_FILE.format(shard)), 'wb')
+
+                file.write(image.tobytes())
+
+                shards[idx], offsets[idx] = shard, shard_bytes
+                heights[idx], widths[idx] = image.shape[:2]
+                boxes.append(image_boxes)
+                shard_bytes += image.nbytes
+        finally:
+            file.close()
+
+        boxes = np.concatenate(boxes) if boxes else np.empty((0, 4), dtype=np.int64)
+        np.savez(os.path.join(path, ShardedDataset.INDEX_FILE), shards=shards, offsets=offsets,
+                 widths=widths, heights=heights, box_offsets=self._offsets, boxes=boxes,
+                 label_codes=self._label_codes, label_names=np.array(self._label_names, dtype=str),
+                 filenames=self._filenames.astype(str))
+
+    # Returns the decoded image at the given index
+    def _load_image(self, idx):
+        return self._read_image(os.path.join(self._root_dir, self._filenames[idx]))
+
+    # Reads in an image, going through the cache if there is one
+    def _read_image(self, path):
+        if self._cache is None:
+            return read_image(path)
+
+        image = self._cache.get(path)
+        if image is None:
+            image = read_image(path)
+            self._cache.put(path, image)
+        return image
+
+    @property
+    def transform(self):
+        return self._transform
+
+    # Setting the transform also precomputes how each of its steps affects
+    # the boxes so that this doesn't need to be redone for every sample
+    @transform.setter
+    def transform(self, transform):
+        self._transform = transform
+        self._transform_plan = []
+
+        if not transform:
+            return
+
+        steps = transform.transforms if hasattr(transform, 'transforms') else [transform]
+        for t in steps:
+            if isinstance(t, transforms.RandomHorizontalFlip):
+                self._transform_plan.append((t, self._FLIP))
+            elif isinstance(t, transforms.Resize):
+                self._transform_plan.append((t, self._RESIZE))
+            else:
+                self._transform_plan.append((t, None))
+
+    # Applies the transform plan to the image and adjusts the (N, 4) box
+    # tensor to match in a handful of vectorized operations. Boxes stay in
+    # the original image's coordinates until the end, where the combined
+    # scaling of all resizes is applied at once.
+    def _apply_transforms(self, image, boxes, width, height):
+        current_width, current_height = width, height
+        scale_x, scale_y = 1.0, 1.0
+
+        for t, kind in self._transform_plan:
+            if kind == self._FLIP:
+                # Apply the flip to both the image and the boxes' x-coordinates,
+                # swapping xmin and xmax so that xmin <= xmax still holds
+                if random.random() < t.p:
+                    image = transforms.functional.hflip(image)
+                    boxes = boxes[:, [2, 1, 0, 3]]
+                    boxes[:, [0, 2]] = width - boxes[:, [0, 2]]
+            else:
+                image = t(image)
+
+                if kind == self._RESIZE:
+                    new_width, new_height, factor_x, factor_y = self._get_resize_factors(
+                        t.size, current_width, current_height, getattr(t, 'max_size', None))
+                    current_width, current_height = new_width, new_height
+                    scale_x *= factor_x
+                    scale_y *= factor_y
+
+        # Scale down boxes if necessary
+        if scale_x != 1.0 or scale_y != 1.0:
+            scale = torch.tensor([scale_x, scale_y, scale_x, scale_y], dtype=torch.float64)
+            boxes = (boxes / scale).long()
+
+        return image, boxes
+
+    # Returns the output size of a transforms.Resize with the given size
+    # applied on an image of the given size, along with the factors by
+    # which each axis is scaled down
+    @staticmethod
+    def _get_resize_factors(size, width, height, max_size=None):
+        if isinstance(size, int) or len(size) == 1:
+            size = size if isinstance(size, int) else size[0]
+
+            # An int size matches the shorter edge to it, keeping the aspect ratio
+            short, long = min(width, height), max(width, height)
+            new_short, new_long = size, int(size * long / short)
+
+            if max_size is not None and new_long > max_size:
+                new_short, new_long = int(max_size * new_short / new_long), max_size
+
+            factor = short / new_short
+            if width <= height:
+                return new_short, new_long, factor, factor
+            return new_long, new_short, factor, factor
+
+        # A sequence size is given as (height, width)
+        new_height, new_width = size
+        return new_width, new_height, width / new_width, height / new_height
+
+
+class ShardedDataset(Dataset):
+
+    # Names of the files written by Dataset.export_shards
+    INDEX_FILE = 'index.npz'
+    SHARD_FILE = 'shard_{:05d}.bin'
+
+    def __init__(self, path, transform=None):
+        """Loads a dataset previously saved with
+        :meth:`detecto.core.Dataset.export_shards`. Images are read
+        straight out of memory-mapped shard files, so no image files are
+        opened or decoded when indexing the dataset, and creating the
+        dataset (e.g. in each :class:`detecto.core.DataLoader` worker)
+        is nearly free. Indexes the same way as, and supports the same
+        transforms as, :class:`detecto.core.Dataset`.
+
+        :param path: The path to the folder containing the shards.
+        :type path: str
+        :param transform: (Optional) A torchvision `transforms.Compose
+            <https://pytorch.org/docs/stable/torchvision/transforms.html#torchvision.transforms.Compose>`__
+            object containing transformations to apply on all elements in
+            the dataset. Images are given to the transforms as uint8 NumPy
+            arrays of shape ``(H, W, 3)`` in RGB format, like those
+            returned by :func:`detecto.utils.read_image`. If None, defaults
+            to the transforms returned by
+            :func:`detecto.utils.default_transforms`.
+        :type transform: torchvision.transforms.Compose or None
+
+        **Example**::
+
+            >>> from detecto.core import Dataset, ShardedDataset
+
+            >>> Dataset('labels.csv', 'images/').export_shards('shards/')
+            >>> dataset = ShardedDataset('shards/')
+            >>> image, target = dataset[0]
+        """
+
+        self._root_dir = path
+        self._cache = None
+        # Memory maps of each shard, opened as they're first needed
+        self._shards = {}
+
+        with np.load(os.path.join(path, self.INDEX_FILE)) as index:
+            self._image_shards = index['shards']
+            self._image_offsets = index['offsets']
+            self._widths = index['widths']
+            self._heights = index['heights']
+            self._offsets = index['box_offsets']
+            self._boxes = index['boxes']
+            self._label_codes = index['label_codes']
+            self._label_names = index['label_names'].tolist()
+            self._filenames = index['filenames']
+
+        self._image_ids = np.arange(len(self._widths))
+
+        if transform is None:
+            self.transform = default_transforms()
+        else:
+            self.transform = transform
+
+    # Returns a view of the image straight out of its shard's memory map
+    def _load_image(self, idx):
+        shard = int(self._image_shards[idx])
+        if shard not in self._shards:
+            # Copy-on-write so the views are writable without ever touching the file
+            file = os.path.join(self._root_dir, self.SHARD_FILE.format(shard))
+            self._shards[shard] = np.memmap(file, dtype=np.uint8, mode='c')
+
+        height, width = self._heights[idx], self._widths[idx]
+        offset = self._image_offsets[idx]
+        return self._shards[shard][offset:offset + height * width * 3].reshape(height, width, 3)
+
+    # Memory maps aren't sent to DataLoader worker processes; each worker
+    # opens its own instead
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
 
 class Model:
 
@@ -223,7 +500,90 @@ class Model:
     MOBILENET = 'fasterrcnn_mobilenet_v3_large_fpn'
     MOBILENET_320 = 'fasterrcnn_mobilenet_v3_large_320_fpn'
 
-    def __init__(self, classes=None, device=None, pretrained=True, model_name=DEFAULT):
+    FAST = 'fast'
+    BALANCED = 'balanced'
+    ACCURATE = 'accurate'
+
+    # Inference options of each preset, relative to each model's own
+    # defaults (the "balanced" preset)
+    _FULL_SIZE_PRESETS = {
+        FAST: {
+            'min_size': 512,
+            'max_size': 853,
+            'rpn_pre_nms_top_n_test': 500,
+            'rpn_post_nms_top_n_test': 300,
+            'box_detections_per_img': 100,
+            'box_score_thresh': 0.05,
+        },
+        BALANCED: {
+            'min_size': 800,
+            'max_size': 1333,
+            'rpn_pre_nms_top_n_test': 1000,
+            'rpn_post_nms_top_n_test': 1000,
+            'box_detections_per_img': 100,
+            'box_score_thresh': 0.05,
+        },
+        ACCURATE: {
+            'min_size': 1024,
+            'max_size': 1707,
+            'rpn_pre_nms_top_n_test': 2000,
+            'rpn_post_nms_top_n_test': 2000,
+            'box_detections_per_img': 300,
+            'box_score_thresh': 0.01,
+        },
+    }
+
+    PRESETS = {
+        DEFAULT: _FULL_SIZE_PRESETS,
+        MOBILENET: _FULL_SIZE_PRESETS,
+        MOBILENET_320: {
+            FAST: {
+                'min_size': 256,
+                'max_size': 512,
+                'rpn_pre_nms_top_n_test': 100,
+                'rpn_post_nms_top_n_test': 75,
+                'box_detections_per_img': 100,
+                'box_score_thresh': 0.05,
+            },
+            BALANCED: {
+                'min_size': 320,
+                'max_size': 640,
+                'rpn_pre_nms_top_n_test': 150,
+                'rpn_post_nms_top_n_test': 150,
+                'box_detections_per_img': 100,
+                'box_score_thresh': 0.05,
+            },
+            ACCURATE: {
+                'min_size': 416,
+                'max_size': 832,
+                'rpn_pre_nms_top_n_test': 300,
+                'rpn_post_nms_top_n_test': 300,
+                'box_detections_per_img': 300,
+                'box_score_thresh': 0.01,
+            },
+        },
+    }
+
+    # Formats that predictions can be returned in
+    LABELS = 'labels'
+    LABEL_IDS = 'label_ids'
+    ARRAY = 'array'
+
+    # Fields of the structured arrays returned when predicting in ARRAY format
+    PREDICTION_DTYPE = np.dtype([('x1', np.float32), ('y1', np.float32), ('x2', np.float32), ('y2', np.float32),
+                                 ('score', np.float32), ('label', np.int32)])
+
+    # Key of detecto's metadata within saved TorchScript and ONNX models
+    _METADATA_FILE = 'detecto.json'
+
+    # Transforms applied to images that aren't tensors yet when predicting.
+    # They're stateless, so they're created once and shared by all models.
+    _TO_TENSOR = transforms.Compose([transforms.ToTensor()])
+    _DEFAULT_TRANSFORMS = default_transforms()
+
+    def __init__(self, classes=None, device=None, pretrained=True, model_name=DEFAULT, preset=None, min_size=None,
+                 max_size=None, rpn_pre_nms_top_n_test=None, rpn_post_nms_top_n_test=None,
+                 box_detections_per_img=None, box_score_thresh=None):
         """Initializes a machine learning model for object detection.
         Models are built on top of PyTorch's `pre-trained models
         <https://pytorch.org/docs/stable/torchvision/models.html>`_,
@@ -251,23 +611,78 @@ class Model:
             ``"fasterrcnn_mobilenet_v3_large_320_fpn"`` (``Model.MOBILENET_320``).
             Defaults to ``"fasterrcnn_resnet50_fpn"``.
         :type model_name: str
+        :param preset: (Optional) A named set of values for the inference
+            options below, trading accuracy for speed. Valid choices are
+            ``"fast"`` (``Model.FAST``), which runs on smaller images with
+            fewer region proposals, ``"balanced"`` (``Model.BALANCED``),
+            which matches torchvision's defaults for the chosen model, and
+            ``"accurate"`` (``Model.ACCURATE``), which runs on larger images
+            with more region proposals and detections. Presets are relative
+            to the chosen model, so e.g. ``Model.FAST`` runs on smaller
+            images with ``Model.MOBILENET_320`` than with ``Model.DEFAULT``.
+            See ``Model.PRESETS[model_name]`` for the exact values. Any of the options
+            below that are given override the preset's value. Defaults to
+            None, in which case the chosen model's own defaults are used.
+        :type preset: str or None
+        :param min_size: (Optional) The size to which the shorter side of
+            each image is resized before being fed into the model. Smaller
+            sizes are faster but miss more small objects. Defaults to None.
+        :type min_size: int or None
+        :param max_size: (Optional) The maximum size of the longer side of
+            each image after it's resized. Defaults to None.
+        :type max_size: int or None
+        :param rpn_pre_nms_top_n_test: (Optional) The number of top-scoring
+            region proposals kept per feature map level before non-maximum
+            suppression when predicting. Defaults to None.
+        :type rpn_pre_nms_top_n_test: int or None
+        :param rpn_post_nms_top_n_test: (Optional) The number of region
+            proposals kept after non-maximum suppression when predicting,
+            i.e. the number of regions the box head classifies. Defaults
+            to None.
+        :type rpn_post_nms_top_n_test: int or None
+        :param box_detections_per_img: (Optional) The maximum number of
+            detections returned for each image. Defaults to None.
+        :type box_detections_per_img: int or None
+        :param box_score_thresh: (Optional) The minimum score of returned
+            detections. Defaults to None.
+        :type box_score_thresh: float or None
 
         **Example**::
 
             >>> from detecto.core import Model
 
             >>> model = Model(['dog', 'cat', 'bunny'])
+            >>> # Faster but less accurate, with at most 20 detections per image
+            >>> fast_model = Model(['dog', 'cat', 'bunny'], preset=Model.FAST, box_detections_per_img=20)
         """
 
         self._device = device if device else config['default_device']
 
+        if preset is not None and preset not in (self.FAST, self.BALANCED, self.ACCURATE):
+            raise ValueError(f'Invalid value {preset} for preset. ' +
+                             f'Please choose between {self.FAST}, {self.BALANCED}, and {self.ACCURATE}.')
+
+        # Inference options passed on to torchvision's FasterRCNN
+        options = dict(self.PRESETS.get(model_name, {}).get(preset, {})) if preset is not None else {}
+        overrides = {
+            'min_size': min_size,
+            'max_size': max_size,
+            'rpn_pre_nms_top_n_test': rpn_pre_nms_top_n_test,
+            'rpn_post_nms_top_n_test': rpn_post_nms_top_n_test,
+            'box_detections_per_img': box_detections_per_img,
+            'box_score_thresh': box_score_thresh,
+        }
+        options.update({k: v for k, v in overrides.items() if v is not None})
+
         # Load a model pre-trained on COCO
         if model_name == self.DEFAULT:
-            self._model = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=pretrained)
+            self._model = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=pretrained, **options)
         elif model_name == self.MOBILENET:
-            self._model = torchvision.models.detection.fasterrcnn_mobilenet_v3_large_fpn(pretrained=pretrained)
+            self._model = torchvision.models.detection.fasterrcnn_mobilenet_v3_large_fpn(pretrained=pretrained,
+                                                                                         **options)
         elif model_name == self.MOBILENET_320:
-            self._model = torchvision.models.detection.fasterrcnn_mobilenet_v3_large_320_fpn(pretrained=pretrained)
+            self._model = torchvision.models.detection.fasterrcnn_mobilenet_v3_large_320_fpn(pretrained=pretrained,
+                                                                                             **options)
         else:
             raise ValueError(f'Invalid value {model_name} for model_name. ' +
                              f'Please choose between {self.DEFAULT}, {self.MOBILENET}, and {self.MOBILENET_320}.')
@@ -283,40 +698,130 @@ class Model:
             self._disable_normalize = True
 
         self._model.to(self._device)
+        self._quantized = False
 
         # Mappings to convert from string labels to ints and vice versa
         self._classes = ['__background__'] + classes
         self._int_mapping = {label: index for index, label in enumerate(self._classes)}
 
-    # Returns the raw predictions from feeding an image or list of images into the model
-    def _get_raw_predictions(self, images):
-        self._model.eval()
+    @property
+    def classes(self):
+        """The model's class table: the label with id ``i`` is
+        ``model.classes[i]``, where id 0 is the ``__background__`` class.
+        Used to look up the label ids returned when predicting in the
+        ``Model.LABEL_IDS`` or ``Model.ARRAY`` formats.
+
+        **Example**::
 
-        with torch.no_grad():
+            >>> from detecto.core import Model
+
+            >>> model = Model(['dog', 'cat'])
+            >>> model.classes
+            ['__background__', 'dog', 'cat']
+        """
+
+        return list(self._classes)
+
+    # Returns the raw predictions from feeding an image or list of images into
+    # the model, keeping only those scoring above score_threshold and of the
+    # given classes (if not None)
+    def _get_raw_predictions(self, images, score_threshold=None, classes=None):
+        # Only switch modes when needed, e.g. right after training
+        if getattr(self._model, 'training', False):
+            self._model.eval()
+
+        # Torchvision models can filter their detections before running NMS
+        # on them; scripted and ONNX models are filtered afterwards instead
+        filter_internally = isinstance(self._model, GeneralizedRCNN)
+        if filter_internally:
+            postprocessing = self._postprocessing(score_threshold, classes)
+        else:
+            postprocessing = nullcontext()
+
+        with torch.inference_mode():
             # Convert image into a list of length 1 if not already a list
             if not _is_iterable(images):
                 images = [images]
 
-            # Convert to tensor and normalize if not already
-            if not isinstance(images[0], torch.Tensor):
-                # This is a temporary workaround to the bad accuracy
-                # when normalizing on default weights. Will need to
-                # investigate further TODO
-                if self._disable_normalize:
-                    defaults = transforms.Compose([transforms.ToTensor()])
-                else:
-                    defaults = default_transforms()
-                images = [defaults(img) for img in images]
+            images = self._preprocess(images)
 
             # Send images to the specified device
             images = [img.to(self._device) for img in images]
 
-            preds = self._model(images)
-            # Send predictions to CPU if not already
-            preds = [{k: v.to(torch.device('cpu')) for k, v in p.items()} for p in preds]
+            with postprocessing:
+                preds = self._model(images)
+            # Scripted models always return a (losses, detections) tuple
+            if isinstance(preds, tuple):
+                preds = preds[1]
+
+        # Done outside of inference mode so that the returned
+        # tensors can be freely modified and used by the caller
+        preds = self._to_cpu(preds)
+
+        if not filter_internally and (score_threshold is not None or classes is not None):
+            preds = [self._filter_prediction(pred, score_threshold, classes) for pred in preds]
+        return preds
+
+    # Temporarily configures the model's box head to drop detections scoring
+    # at or below score_threshold or not of the given classes before NMS
+    @contextmanager
+    def _postprocessing(self, score_threshold, classes):
+        roi_heads = self._model.roi_heads
+        score_thresh, box_predictor = roi_heads.score_thresh, roi_heads.box_predictor
+
+        try:
+            # Only ever tighten the model's own threshold, like the
+            # filtering of models that can't be reconfigured
+            if score_threshold is not None:
+                roi_heads.score_thresh = max(score_threshold, score_thresh)
+            if classes is not None:
+                roi_heads.box_predictor = _ClassFilter(box_predictor, self._get_class_mask(classes))
+            yield
+        finally:
+            roi_heads.score_thresh, roi_heads.box_predictor = score_thresh, box_predictor
+
+    # Returns a boolean tensor marking which class indices to keep
+    def _get_class_mask(self, classes):
+        mask = torch.zeros(len(self._classes), dtype=torch.bool)
+        for label in classes:
+            if label not in self._int_mapping:
+                raise ValueError(f'Invalid class {label}; the model\'s classes are {self._classes[1:]}')
+            mask[self._int_mapping[label]] = True
+        return mask
+
+    # Filters a single prediction by score and class after the fact
+    def _filter_prediction(self, pred, score_threshold, classes):
+        keep = torch.ones(len(pred['scores']), dtype=torch.bool)
+        if score_threshold is not None:
+            keep &= pred['scores'] > score_threshold
+        if classes is not None:
+            keep &= self._get_class_mask(classes)[pred['labels'].long()]
+        return {k: v[keep] for k, v in pred.items()}
+
+    # Sends predictions to the CPU, concatenating the tensors of each key
+    # across all predictions so that each key only needs a single transfer
+    @staticmethod
+    def _to_cpu(preds):
+        if len(preds) == 0:
             return preds
 
-    def predict(self, images):
+        sizes = [len(p['scores']) for p in preds]
+        gathered = {k: torch.cat([p[k] for p in preds]).to(torch.device('cpu')).split(sizes) for k in preds[0]}
+        return [{k: v[i] for k, v in gathered.items()} for i in range(len(preds))]
+
+    # Converts a list of images to tensors and normalizes them if not already
+    def _preprocess(self, images):
+        if len(images) == 0 or isinstance(images[0], torch.Tensor):
+            return images
+
+        # This is a temporary workaround to the bad accuracy
+        # when normalizing on default weights. Will need to
+        # investigate further TODO
+        defaults = self._TO_TENSOR if self._disable_normalize else self._DEFAULT_TRANSFORMS
+        return [defaults(img) for img in images]
+
+    def predict(self, images, batch_size=None, group_by_size=False, score_threshold=None, classes=None,
+                output_format=LABELS):
         """Takes in an image or list of images and returns predictions
         for object locations.
 
@@ -325,6 +830,43 @@ class Model:
             objects, the default transformations contained in
             :func:`detecto.utils.default_transforms` will be applied.
         :type images: list or numpy.ndarray or torch.Tensor
+        :param batch_size: (Optional) The maximum number of images to feed
+            into the model at once. Smaller batches bound the memory used
+            when predicting on long lists of images. Results are always
+            returned in the same order as ``images``. Defaults to None, in
+            which case all images are fed in as a single batch.
+        :type batch_size: int or None
+        :param group_by_size: (Optional) Whether to batch images of similar
+            aspect ratios together when ``batch_size`` is given. Since the
+            model resizes every image to a common scale and then pads them
+            all to the largest one in the batch, this minimizes the amount
+            of padding the model has to process. Defaults to False.
+        :type group_by_size: bool
+        :param score_threshold: (Optional) If given, only returns the
+            detections scoring above this value. Low-scoring detections are
+            dropped inside the model before non-maximum suppression, which
+            is cheaper than filtering the returned predictions. This can
+            only tighten the model's own threshold (its
+            ``box_score_thresh``), never loosen it. Defaults to None, in
+            which case the model's own threshold is used.
+        :type score_threshold: float or None
+        :param classes: (Optional) If given, only returns detections of
+            these classes/labels. Like ``score_threshold``, the other
+            classes are dropped inside the model, and the scores of the
+            returned detections are unaffected. Defaults to None.
+        :type classes: list or None
+        :param output_format: (Optional) The format to return the
+            predictions of each image in. ``Model.LABELS`` returns the
+            tuples described below. ``Model.LABEL_IDS`` returns the same
+            tuples, except with the labels as a torch.Tensor of integer ids
+            indexing into :attr:`detecto.core.Model.classes`, which avoids
+            creating a Python string for every detection.
+            ``Model.ARRAY`` returns a single NumPy structured array of
+            dtype ``Model.PREDICTION_DTYPE`` with the fields ``x1``,
+            ``y1``, ``x2``, ``y2``, ``score``, and ``label`` (an id), which
+            is cheap to serialize and aggregate. Defaults to
+            ``Model.LABELS``.
+        :type output_format: str
         :return: If given a single image, returns a tuple of size
             three. The first element is a list of string labels of size N,
             the number of detected objects. The second element is a
@@ -333,8 +875,9 @@ class Model:
             object. The third element is a torch.Tensor of size N containing
             the scores of each predicted object (ranges from 0.0 to 1.0). If
             given a list of images, returns a list of the tuples described
-            above, each tuple corresponding to a single image.
-        :rtype: tuple or list of tuple
+            above, each tuple corresponding to a single image. See
+            ``output_format`` for the other formats.
+        :rtype: tuple or numpy.ndarray or list
 
         **Example**::
 
@@ -350,23 +893,146 @@ class Model:
             horse
             tensor([   0.0000,  428.0744, 1617.1860, 1076.3607])
             tensor(0.9397)
+
+            >>> # Only get confident zebra detections
+            >>> labels, boxes, scores = model.predict(image, score_threshold=0.8, classes=['zebra'])
+
+            >>> # Get label ids, or everything in a single structured array
+            >>> label_ids, boxes, scores = model.predict(image, output_format=Model.LABEL_IDS)
+            >>> [model.classes[i] for i in label_ids]
+            ['horse', 'zebra']
+            >>> preds = model.predict(image, output_format=Model.ARRAY)
+            >>> preds[preds['score'] > 0.9][['label', 'score']]
+            array([(1, 0.9397)], dtype=[('label', '<i4'), ('score', '<f4')])
         """
 
+        self._check_output_format(output_format)
+
         # Convert all to lists but keep track if a single image was given
         is_single_image = not _is_iterable(images)
         images = [images] if is_single_image else images
-        preds = self._get_raw_predictions(images)
 
-        results = []
-        for pred in preds:
-            # Convert predicted ints into their corresponding string labels
-            result = ([self._classes[val] for val in pred['labels']], pred['boxes'], pred['scores'])
-            results.append(result)
+        order = list(range(len(images)))
+        if batch_size is None:
+            batch_size = max(len(images), 1)
+        elif group_by_size:
+            order.sort(key=lambda i: _get_aspect_ratio(images[i]))
+
+        batches = [order[start:start + batch_size] for start in range(0, len(images), batch_size)]
+        image_batches = ([images[i] for i in batch] for batch in batches)
+        get_predictions = partial(self._get_raw_predictions, score_threshold=score_threshold, classes=classes)
+
+        # With multiple batches, preprocess the next batch while the model runs
+        if len(batches) > 1:
+            batch_preds = _run_pipeline(image_batches, [self._preprocess, get_predictions])
+        else:
+            batch_preds = map(get_predictions, image_batches)
+
+        results = [None] * len(images)
+        for batch, preds in zip(batches, batch_preds):
+            for i, pred in zip(batch, preds):
+                results[i] = self._to_result(pred, output_format)
 
         return results[0] if is_single_image else results
 
+    # Converts a raw prediction into the given output format
+    def _to_result(self, pred, output_format=LABELS):
+        if output_format == self.LABEL_IDS:
+            return pred['labels'], pred['boxes'], pred['scores']
+        if output_format == self.ARRAY:
+            return self._to_array(pred['labels'], pred['boxes'], pred['scores'])
+
+        # Converts predicted ints into their corresponding string labels
+        return [self._classes[val] for val in pred['labels'].tolist()], pred['boxes'], pred['scores']
+
+    # Packs label ids, boxes and scores into one structured array
+    @classmethod
+    def _to_array(cls, labels, boxes, scores):
+        array = np.empty(len(scores), dtype=cls.PREDICTION_DTYPE)
+        boxes = boxes.numpy()
+        for i, field in enumerate(['x1', 'y1', 'x2', 'y2']):
+            array[field] = boxes[:, i]
+        array['score'] = scores.numpy()
+        array['label'] = labels.numpy()
+        return array
+
+    # Raises an error if given an unknown output format
+    def _check_output_format(self, output_format):
+        if output_format not in [self.LABELS, self.LABEL_IDS, self.ARRAY]:
+            raise ValueError(f'Invalid value {output_format} for output_format. ' +
+                             f'Please choose between {self.LABELS}, {self.LABEL_IDS}, and {self.ARRAY}.')
+
+    def predict_iter(self, images, batch_size=1, prefetch=2, score_threshold=None, classes=None,
+                     output_format=LABELS):
+        """Lazily predicts on an iterable of images, yielding the predictions
+        for each image as soon as its batch is done. Unlike
+        :meth:`detecto.core.Model.predict`, the images never all need to be
+        in memory at once, so this can be used to predict on entire
+        folders or other arbitrarily long streams of images. Reading in
+        images, preprocessing them and running the model each happen on
+        their own background thread, so that upcoming batches are read in
+        and preprocessed while the model runs on the current one.
+
+        :param images: An iterable of images to predict on. Each image can
+            be the path to an image file, which is read in with
+            :func:`detecto.utils.read_image`, or anything else accepted by
+            :meth:`detecto.core.Model.predict`.
+        :type images: iterable
+        :param batch_size: (Optional) The number of images to feed into
+            the model at once. Defaults to 1.
+        :type batch_size: int
+        :param prefetch: (Optional) The maximum number of batches each
+            stage can get ahead of the next one. Higher values better
+            absorb uneven read times at the cost of memory. Defaults to 2.
+        :type prefetch: int
+        :param score_threshold: (Optional) If given, only returns the
+            detections scoring above this value. See
+            :meth:`detecto.core.Model.predict`. Defaults to None.
+        :type score_threshold: float or None
+        :param classes: (Optional) If given, only returns detections of
+            these classes/labels. See :meth:`detecto.core.Model.predict`.
+            Defaults to None.
+        :type classes: list or None
+        :param output_format: (Optional) The format to return each image's
+            predictions in. See :meth:`detecto.core.Model.predict`.
+            Defaults to ``Model.LABELS``.
+        :type output_format: str
+        :return: A generator yielding a tuple of size three for each
+            image, in the same order as ``images``. See
+            :meth:`detecto.core.Model.predict` for the format of each tuple.
+        :rtype: generator
+
+        **Example**::
+
+            >>> from glob import glob
+            >>> from detecto.core import Model
+
+            >>> model = Model.load('model_weights.pth', ['cat', 'dog'])
+            >>> files = glob('images/*.jpg')
+            >>> for file, (labels, boxes, scores) in zip(files, model.predict_iter(files, batch_size=4)):
+            >>>     print(file, labels)
+            images/0.jpg ['cat', 'dog']
+            images/1.jpg ['dog']
+            ...
+        """
+
+        self._check_output_format(output_format)
 
-    def predict_top(self, images):
+        iterator = iter(images)
+        batches = iter(lambda: list(islice(iterator, batch_size)), [])
+
+        # Reads in any images given as file paths
+        def read_batch(batch):
+            return [read_image(img) if isinstance(img, str) else img for img in batch]
+
+        get_predictions = partial(self._get_raw_predictions, score_threshold=score_threshold, classes=classes)
+        stages = [read_batch, self._preprocess, get_predictions]
+        for preds in _run_pipeline(batches, stages, queue_size=prefetch):
+            for pred in preds:
+                yield self._to_result(pred, output_format)
+
+    def predict_top(self, images, batch_size=None, group_by_size=False, score_threshold=None, classes=None,
+                    output_format=LABELS):
         """Takes in an image or list of images and returns the top
         scoring predictions for each detected label in each image.
         Equivalent to running :meth:`detecto.core.Model.predict` and
@@ -377,6 +1043,26 @@ class Model:
             objects, the default transformations contained in
             :func:`detecto.utils.default_transforms` will be applied.
         :type images: list or numpy.ndarray or torch.Tensor
+        :param batch_size: (Optional) The maximum number of images to feed
+            into the model at once. See :meth:`detecto.core.Model.predict`.
+            Defaults to None.
+        :type batch_size: int or None
+        :param group_by_size: (Optional) Whether to batch images of similar
+            aspect ratios together. See :meth:`detecto.core.Model.predict`.
+            Defaults to False.
+        :type group_by_size: bool
+        :param score_threshold: (Optional) If given, only considers the
+            detections scoring above this value. See
+            :meth:`detecto.core.Model.predict`. Defaults to None.
+        :type score_threshold: float or None
+        :param classes: (Optional) If given, only considers detections of
+            these classes/labels. See :meth:`detecto.core.Model.predict`.
+            Defaults to None.
+        :type classes: list or None
+        :param output_format: (Optional) The format to return each image's
+            predictions in. See :meth:`detecto.core.Model.predict`.
+            Defaults to ``Model.LABELS``.
+        :type output_format: str
         :return: If given a single image, returns a tuple of size
             three. The first element is a list of string labels of size K,
             the number of uniquely detected objects. The second element is
@@ -386,9 +1072,8 @@ class Model:
             of size K containing the scores of each uniquely predicted object
             (ranges from 0.0 to 1.0). If given a list of images, returns a
             list of the tuples described above, each tuple corresponding to
-            a single image.
-        :rtype: tuple or list of tuple
-
+            a single image. See ``output_format`` for the other formats.
+        :rtype: tuple or numpy.ndarray or list
 
         **Example**::
 
@@ -403,17 +1088,127 @@ class Model:
             [ 875.3470,  412.1762,  949.5915,  793.3424]]), tensor([0.9397, 0.8686]))
         """
 
-        predictions = self.predict(images)
+        self._check_output_format(output_format)
+        # Arrays are built from the filtered label ids
+        predict_format = self.LABEL_IDS if output_format == self.ARRAY else output_format
+        predictions = self.predict(images, batch_size=batch_size, group_by_size=group_by_size,
+                                   score_threshold=score_threshold, classes=classes, output_format=predict_format)
 
         # If tuple but not list, then images is a single image
         if not isinstance(predictions, list):
-            return filter_top_predictions(*predictions)
+            results = filter_top_predictions(*predictions)
+            return self._to_array(*results) if output_format == self.ARRAY else results
+
+        results = filter_top_predictions_batch(predictions)
+        return [self._to_array(*result) for result in results] if output_format == self.ARRAY else results
+
+    def predict_tiled(self, image, tile_size=800, overlap=0.2, batch_size=4, iou_threshold=0.5,
+                      score_threshold=None, classes=None, output_format=LABELS):
+        """Predicts on a large image by splitting it into overlapping
+        tiles and predicting on each tile separately, so that small
+        objects aren't lost when the model downsizes the image. The tiles'
+        boxes are mapped back onto the full image, and duplicate detections
+        of objects lying across tile borders are merged with non-maximum
+        suppression.
+
+        :param image: The image to predict on, or the path to it. If the
+            image has not already been transformed into a torch.Tensor
+            object, the default transformations contained in
+            :func:`detecto.utils.default_transforms` will be applied.
+        :type image: numpy.ndarray or torch.Tensor or str
+        :param tile_size: (Optional) The height and width of each tile, as
+            an int or a ``(height, width)`` tuple. Tiles close to the model's
+            ``min_size`` are barely rescaled by the model, so the image is
+            effectively processed at full resolution. Defaults to 800.
+        :type tile_size: int or tuple
+        :param overlap: (Optional) The fraction of each tile that overlaps
+            with its neighbors, in [0, 1). Should be large enough for the
+            largest objects to fit entirely within at least one tile.
+            Defaults to 0.2.
+        :type overlap: float
+        :param batch_size: (Optional) The number of tiles to feed into the
+            model at once. Tiles are only converted to tensors a batch at a
+            time, which bounds the memory used regardless of the image's
+            size. Defaults to 4.
+        :type batch_size: int
+        :param iou_threshold: (Optional) Detections of the same label whose
+            IoU is above this value are merged into the highest scoring one.
+            Defaults to 0.5.
+        :type iou_threshold: float
+        :param score_threshold: (Optional) If given, only returns the
+            detections scoring above this value. See
+            :meth:`detecto.core.Model.predict`. Defaults to None.
+        :type score_threshold: float or None
+        :param classes: (Optional) If given, only returns detections of
+            these classes/labels. See :meth:`detecto.core.Model.predict`.
+            Defaults to None.
+        :type classes: list or None
+        :param output_format: (Optional) The format to return the
+            predictions in. See :meth:`detecto.core.Model.predict`.
+            Defaults to ``Model.LABELS``.
+        :type output_format: str
+        :return: A tuple of size three, in the same format as the output
+            of :meth:`detecto.core.Model.predict` on a single image, with
+            the boxes in the full image's coordinates and the predictions
+            sorted by decreasing score.
+        :rtype: tuple or numpy.ndarray
 
-        results = []
-        for pred in predictions:
-            results.append(filter_top_predictions(*pred))
+        **Example**::
 
-        return results
+            >>> from detecto.core import Model
+            >>> from detecto.utils import read_image
+
+            >>> model = Model.load('model_weights.pth', ['car', 'building'])
+            >>> image = read_image('aerial.tif')  # 8000x6000
+            >>> labels, boxes, scores = model.predict_tiled(image, tile_size=1024, overlap=0.25)
+        """
+
+        self._check_output_format(output_format)
+        if not 0 <= overlap < 1:
+            raise ValueError(f'Invalid value {overlap} for overlap. Please choose a value in [0, 1).')
+
+        if isinstance(image, str):
+            image = read_image(image)
+
+        # Tiles are cut out of the original image and preprocessed a batch
+        # at a time, so the whole image is never converted to floats at once
+        is_tensor = isinstance(image, torch.Tensor)
+        tile_height, tile_width = (tile_size, tile_size) if isinstance(tile_size, int) else tile_size
+        height, width = image.shape[-2:] if is_tensor else image.shape[:2]
+        tiles = [(x, y) for y in self._get_tile_offsets(height, tile_height, overlap)
+                 for x in self._get_tile_offsets(width, tile_width, overlap)]
+
+        get_predictions = partial(self._get_raw_predictions, score_threshold=score_threshold, classes=classes)
+        labels, boxes, scores = [], [], []
+        for start in range(0, len(tiles), batch_size):
+            batch = tiles[start:start + batch_size]
+            if is_tensor:
+                crops = [image[:, y:y + tile_height, x:x + tile_width] for x, y in batch]
+            else:
+                crops = [image[y:y + tile_height, x:x + tile_width] for x, y in batch]
+            preds = get_predictions(crops)
+
+            for (x, y), pred in zip(batch, preds):
+                labels.append(pred['labels'])
+                boxes.append(pred['boxes'] + torch.tensor([x, y, x, y], dtype=pred['boxes'].dtype))
+                scores.append(pred['scores'])
+
+        labels, boxes, scores = torch.cat(labels), torch.cat(boxes), torch.cat(scores)
+        # Only boxes with the same label suppress each other
+        keep = torchvision.ops.batched_nms(boxes, scores, labels, iou_threshold)
+
+        return self._to_result({'labels': labels[keep], 'boxes': boxes[keep], 'scores': scores[keep]}, output_format)
+
+    # Returns the offsets of tiles of the given size covering the given
+    # length, spaced evenly so that the last tile ends at the very edge
+    @staticmethod
+    def _get_tile_offsets(length, tile_size, overlap):
+        if length <= tile_size:
+            return [0]
+
+        stride = max(int(tile_size * (1 - overlap)), 1)
+        num_tiles = -(-(length - tile_size) // stride) + 1
+        return np.linspace(0, length - tile_size, num_tiles).round().astype(int).tolist()
 
     def fit(self, dataset, val_dataset=None, epochs=10, learning_rate=0.005, momentum=0.9,
             weight_decay=0.0005, gamma=0.1, lr_step_size=3, verbose=True):
@@ -557,6 +1352,102 @@ class Model:
         if len(losses) > 0:
             return losses
 
+    def quantize(self, calibration_data=None, num_calibration_images=100):
+        """Converts the model to use int8 weights and arithmetic where
+        supported, which makes predicting on a CPU considerably faster
+        at the cost of a small drop in accuracy. The fully-connected
+        layers of the box head are always dynamically quantized. If
+        ``calibration_data`` is given, the convolutional backbone is also
+        statically quantized, using the data to calibrate the ranges of
+        its activations. Quantization is only supported on the CPU, and
+        a quantized model can no longer be trained or saved; save the
+        model's weights before quantizing it, and quantize it again
+        after loading them with :meth:`detecto.core.Model.load`.
+
+        :param calibration_data: (Optional) Images representative of the
+            ones the model will predict on, used to calibrate the
+            quantized backbone. Can be a :class:`detecto.core.Dataset`, a
+            :class:`detecto.core.DataLoader`, or a list of images in any
+            format accepted by :meth:`detecto.core.Model.predict`. The
+            images of a dataset are read without its transforms and
+            preprocessed the same way as when predicting. Defaults to
+            None, in which case only the box head is quantized.
+        :type calibration_data: detecto.core.Dataset or
+            detecto.core.DataLoader or list or None
+        :param num_calibration_images: (Optional) The maximum number of
+            images from ``calibration_data`` to calibrate with. Defaults
+            to 100.
+        :type num_calibration_images: int
+
+        **Example**::
+
+            >>> import torch
+            >>> from detecto.core import Model, Dataset
+            >>> from detecto.utils import read_image
+
+            >>> model = Model.load('model_weights.pth', ['cat', 'dog'], device=torch.device('cpu'))
+            >>> model.quantize(Dataset('calibration_images/'))
+            >>> labels, boxes, scores = model.predict(read_image('image.jpg'))
+        """
+
+        if self._device != torch.device('cpu'):
+            raise ValueError('Quantization is only supported for models on the CPU')
+
+        # Newer versions of PyTorch moved quantization to torch.ao and take a
+        # QConfigMapping and example inputs instead of a qconfig_dict
+        engine = torch.backends.quantized.engine
+        try:
+            from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+            from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+            prepare_args = (get_default_qconfig_mapping(engine), (torch.rand(1, 3, 224, 224),))
+        except ImportError:
+            from torch.quantization import get_default_qconfig, quantize_dynamic
+            from torch.quantization.quantize_fx import convert_fx, prepare_fx
+            prepare_args = ({'': get_default_qconfig(engine)},)
+
+        self._model.eval()
+        roi_heads = self._model.roi_heads
+        roi_heads.box_head = quantize_dynamic(roi_heads.box_head, {torch.nn.Linear}, dtype=torch.qint8)
+        roi_heads.box_predictor = quantize_dynamic(roi_heads.box_predictor, {torch.nn.Linear}, dtype=torch.qint8)
+        self._quantized = True
+
+        if calibration_data is None:
+            return
+
+        # Insert observers into the backbone, run the calibration images
+        # through the whole model to record activation ranges, then convert
+        backbone = self._model.backbone
+        backbone.body = prepare_fx(backbone.body, *prepare_args)
+
+        for images in self._get_calibration_batches(calibration_data, num_calibration_images):
+            self._get_raw_predictions(images)
+
+        backbone.body = convert_fx(backbone.body)
+
+    # Yields lists of at most num_images images in total from a Dataset,
+    # DataLoader or list of images. Images are read from datasets without
+    # their transforms, so that they get preprocessed the same way as when
+    # predicting (e.g. unnormalized for the default model)
+    @staticmethod
+    def _get_calibration_batches(data, num_images):
+        batch_size = 1
+        if isinstance(data, DataLoader) and isinstance(data.dataset, Dataset):
+            data, batch_size = data.dataset, data.batch_size or 1
+
+        if isinstance(data, Dataset):
+            images = (data._load_image(i) for i in range(len(data)))
+        elif isinstance(data, DataLoader):
+            images = (image for images, _ in data for image in images)
+        else:
+            images = iter(data)
+
+        images = islice(images, num_images)
+        while True:
+            batch = list(islice(images, batch_size))
+            if len(batch) == 0:
+                return
+            yield batch
+
     def get_internal_model(self):
         """Returns the internal torchvision model that this class contains
         to allow for more advanced fine-tuning and the full use of
@@ -578,7 +1469,8 @@ class Model:
         return self._model
 
     def save(self, file):
-        """Saves the internal model weights to a file.
+        """Saves the internal model weights to a file. Quantized models
+        can't be saved; save the model before quantizing it instead.
 
         :param file: The name of the file. Should have a .pth file extension.
         :type file: str
@@ -591,10 +1483,189 @@ class Model:
             >>> model.save('model_weights.pth')
         """
 
+        if self._quantized:
+            raise ValueError('Quantized models cannot be saved. Please save the model before quantizing it')
+
         torch.save(self._model.state_dict(), file)
 
+    def export_torchscript(self, file):
+        """Compiles the model with `TorchScript
+        <https://pytorch.org/docs/stable/jit.html>`_, freezes it for
+        inference, and saves it to a file along with its classes. The
+        saved model can be loaded with
+        :meth:`detecto.core.Model.load_scripted` without having to build
+        the torchvision model in Python first, which makes loading it
+        faster and reduces the Python overhead of each prediction. The
+        saved model can only be used for predictions, not training.
+
+        :param file: The name of the file. Should have a .pt file extension.
+        :type file: str
+
+        **Example**::
+
+            >>> from detecto.core import Model
+
+            >>> model = Model.load('model_weights.pth', ['tree', 'bush', 'leaf'])
+            >>> model.export_torchscript('model_scripted.pt')
+        """
+
+        self._model.eval()
+        scripted = torch.jit.freeze(torch.jit.script(self._model))
+
+        metadata = {'classes': self._classes[1:], 'disable_normalize': self._disable_normalize}
+        torch.jit.save(scripted, file, _extra_files={self._METADATA_FILE: json.dumps(metadata)})
+
     @staticmethod
-    def load(file, classes, model_name=DEFAULT):
+    def load_scripted(file, classes=None, device=None, optimize=True):
+        """Loads a model saved with :meth:`detecto.core.Model.export_torchscript`.
+        The returned model can be used for predictions just like any
+        other model, but can't be trained or saved again.
+
+        :param file: The path to the .pt file containing the saved model.
+        :type file: str
+        :param classes: (Optional) The list of classes/labels the model
+            predicts. Defaults to None, in which case the classes saved
+            along with the model are used.
+        :type classes: list or None
+        :param device: (Optional) The device on which to run the model.
+            See :meth:`detecto.core.Model.__init__`. Defaults to None.
+        :type device: torch.device or None
+        :param optimize: (Optional) Whether to further optimize the loaded
+            model for the current device with
+            `torch.jit.optimize_for_inference
+            <https://pytorch.org/docs/stable/generated/torch.jit.optimize_for_inference.html>`_.
+            Defaults to True.
+        :type optimize: bool
+        :return: The model loaded from the file.
+        :rtype: detecto.core.Model
+
+        **Example**::
+
+            >>> from detecto.core import Model
+            >>> from detecto.utils import read_image
+
+            >>> model = Model.load_scripted('model_scripted.pt')
+            >>> labels, boxes, scores = model.predict(read_image('image.jpg'))
+        """
+
+        device = device if device else config['default_device']
+        extra_files = {Model._METADATA_FILE: ''}
+        scripted = torch.jit.load(file, map_location=device, _extra_files=extra_files)
+        metadata = json.loads(extra_files[Model._METADATA_FILE])
+
+        if optimize:
+            scripted = torch.jit.optimize_for_inference(scripted)
+
+        return Model._from_exported(scripted, device, metadata, classes)
+
+    def export_onnx(self, file, opset_version=11):
+        """Exports the model to an `ONNX <https://onnx.ai/>`_ file, along
+        with its classes, so that it can be run by other inference
+        engines. The exported model takes a single image tensor of shape
+        ``(3, H, W)`` of any height and width. Load it back with
+        :meth:`detecto.core.Model.load_onnx` to predict with `ONNX Runtime
+        <https://onnxruntime.ai/>`_. Requires the ``onnx`` package.
+
+        :param file: The name of the file. Should have a .onnx file extension.
+        :type file: str
+        :param opset_version: (Optional) The ONNX opset version to export
+            with. Defaults to 11.
+        :type opset_version: int
+
+        **Example**::
+
+            >>> from detecto.core import Model
+
+            >>> model = Model.load('model_weights.pth', ['tree', 'bush', 'leaf'])
+            >>> model.export_onnx('model.onnx')
+        """
+
+        import onnx
+
+        self._model.eval()
+        example = [torch.rand(3, 800, 800, device=self._device)]
+        output_names = ['boxes', 'labels', 'scores']
+        dynamic_axes = {'images': {1: 'height', 2: 'width'}}
+        dynamic_axes.update({name: {0: 'detections'} for name in output_names})
+
+        kwargs = {}
+        # Newer versions of PyTorch default to the dynamo-based exporter,
+        # which doesn't support the detection models
+        if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+            kwargs['dynamo'] = False
+
+        torch.onnx.export(self._model, (example,), file, opset_version=opset_version, input_names=['images'],
+                          output_names=output_names, dynamic_axes=dynamic_axes, **kwargs)
+
+        # Store the classes in the ONNX file's metadata
+        onnx_model = onnx.load(file)
+        metadata = {'classes': self._classes[1:], 'disable_normalize': self._disable_normalize}
+        onnx.helper.set_model_props(onnx_model, {self._METADATA_FILE: json.dumps(metadata)})
+        onnx.save(onnx_model, file)
+
+    @staticmethod
+    def load_onnx(file, classes=None, num_threads=None, providers=None):
+        """Loads a model saved with :meth:`detecto.core.Model.export_onnx`
+        and runs it with `ONNX Runtime <https://onnxruntime.ai/>`_, which
+        is often faster than PyTorch on the CPU. The returned model can be
+        used for predictions just like any other model, returning labels,
+        boxes and scores in the same format, but can't be trained or
+        saved again. Requires the ``onnxruntime`` package.
+
+        :param file: The path to the .onnx file containing the saved model.
+        :type file: str
+        :param classes: (Optional) The list of classes/labels the model
+            predicts. Defaults to None, in which case the classes saved
+            along with the model are used.
+        :type classes: list or None
+        :param num_threads: (Optional) The number of threads ONNX Runtime
+            uses to run each operator. Defaults to None, in which case
+            ONNX Runtime picks the number of threads.
+        :type num_threads: int or None
+        :param providers: (Optional) The ONNX Runtime execution providers
+            to run the model with, in order of preference. Defaults to
+            None, in which case the CPU execution provider is used.
+        :type providers: list or None
+        :return: The model loaded from the file.
+        :rtype: detecto.core.Model
+
+        **Example**::
+
+            >>> from detecto.core import Model
+            >>> from detecto.utils import read_image
+
+            >>> model = Model.load_onnx('model.onnx', num_threads=4)
+            >>> labels, boxes, scores = model.predict(read_image('image.jpg'))
+        """
+
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+
+        session = onnxruntime.InferenceSession(file, options, providers=providers or ['CPUExecutionProvider'])
+        metadata = json.loads(session.get_modelmeta().custom_metadata_map[Model._METADATA_FILE])
+
+        return Model._from_exported(_OnnxModel(session), torch.device('cpu'), metadata, classes)
+
+    # Wraps an exported model loaded by load_scripted or load_onnx, skipping
+    # __init__ so no torchvision model gets built
+    @classmethod
+    def _from_exported(cls, exported_model, device, metadata, classes=None):
+        model = cls.__new__(cls)
+        model._device = device
+        model._model = exported_model
+        model._quantized = False
+        model._disable_normalize = metadata['disable_normalize']
+        model._classes = ['__background__'] + (classes if classes else metadata['classes'])
+        model._int_mapping = {label: index for index, label in enumerate(model._classes)}
+        return model
+
+    @staticmethod
+    def load(file, classes, model_name=DEFAULT, device=None, quantized=False, calibration_data=None, preset=None,
+             **options):
         """Loads a model from a .pth file containing the model weights.
 
         :param file: The path to the .pth file containing the saved model.
@@ -603,6 +1674,29 @@ class Model:
             to predict. Must be in the same order as initially passed to
             :meth:`detecto.core.Model.__init__` for accurate results.
         :type classes: list
+        :param model_name: (Optional) The name of the Faster R-CNN model
+            the weights are for. See :meth:`detecto.core.Model.__init__`.
+            Defaults to ``"fasterrcnn_resnet50_fpn"``.
+        :type model_name: str
+        :param device: (Optional) The device on which to run the model.
+            See :meth:`detecto.core.Model.__init__`. Defaults to None.
+        :type device: torch.device or None
+        :param quantized: (Optional) Whether to quantize the model after
+            loading it. Requires the model to be on the CPU. See
+            :meth:`detecto.core.Model.quantize`. Defaults to False.
+        :type quantized: bool
+        :param calibration_data: (Optional) If ``quantized`` is True, the
+            data with which to calibrate the quantized backbone. See
+            :meth:`detecto.core.Model.quantize`. Defaults to None.
+        :type calibration_data: detecto.core.Dataset or
+            detecto.core.DataLoader or list or None
+        :param preset: (Optional) The named set of inference options to use.
+            See :meth:`detecto.core.Model.__init__`. Defaults to None.
+        :type preset: str or None
+        :param options: (Optional) Any of the inference options accepted
+            by :meth:`detecto.core.Model.__init__`, such as ``min_size`` or
+            ``box_score_thresh``, overriding those of the preset.
+        :type options: Any
         :return: The model loaded from the file.
         :rtype: detecto.core.Model
 
@@ -611,10 +1705,15 @@ class Model:
             >>> from detecto.core import Model
 
             >>> model = Model.load('model_weights.pth', ['ant', 'bee'])
+            >>> fast_model = Model.load('model_weights.pth', ['ant', 'bee'], preset=Model.FAST, min_size=400)
         """
 
-        model = Model(classes, model_name=model_name, pretrained=False)
+        model = Model(classes, device=device, model_name=model_name, pretrained=False, preset=preset, **options)
         model._model.load_state_dict(torch.load(file, map_location=model._device))
+
+        if quantized:
+            model.quantize(calibration_data)
+
         return model
 
     # Converts all string labels in a list of target dicts to
@@ -632,3 +1731,221 @@ class Model:
         images = [image.to(self._device) for image in images]
         targets = [{k: v.to(self._device) for k, v in t.items()} for t in targets]
         return images, targets
+
+
+class InferencePool:
+
+    def __init__(self, model, num_workers=None, threads_per_worker=None, start_method=None):
+        """Runs a model's predictions on several worker processes at once,
+        for higher throughput on CPUs than a single process can reach.
+        The model's weights are moved into shared memory before the workers
+        start, so they're loaded only once no matter how many workers there
+        are. Use it as a context manager, or call
+        :meth:`detecto.core.InferencePool.close` when done to shut the
+        workers down.
+
+        :param model: The model to predict with. Must be on the CPU and
+            can't be a scripted or ONNX model.
+        :type model: detecto.core.Model
+        :param num_workers: (Optional) The number of worker processes.
+            Defaults to None, in which case one is started per CPU.
+        :type num_workers: int or None
+        :param threads_per_worker: (Optional) The number of threads each
+            worker uses for intra-op parallelism. Defaults to None, in which
+            case the CPUs are split evenly among the workers so that they
+            don't oversubscribe them.
+        :type threads_per_worker: int or None
+        :param start_method: (Optional) How to start the workers: 'fork',
+            'spawn', or 'forkserver'. Defaults to None, in which case the
+            platform's default is used.
+        :type start_method: str or None
+
+        **Example**::
+
+            >>> from glob import glob
+            >>> from detecto.core import Model, InferencePool
+
+            >>> model = Model.load('model_weights.pth', ['cat', 'dog'])
+            >>> with InferencePool(model, num_workers=4) as pool:
+            >>>     predictions = pool.predict(glob('images/*.jpg'), batch_size=2)
+        """
+
+        if not isinstance(model.get_internal_model(), torch.nn.Module) or \
+                isinstance(model.get_internal_model(), torch.jit.ScriptModule):
+            raise ValueError('InferencePool only supports non-scripted PyTorch models')
+        if model._device.type != 'cpu':
+            raise ValueError(f'InferencePool only supports models on the CPU, not {model._device}')
+
+        num_workers = num_workers or os.cpu_count()
+        threads_per_worker = threads_per_worker or max(os.cpu_count() // num_workers, 1)
+
+        # Shared tensors are passed to the workers by reference, not copied
+        model.get_internal_model().share_memory()
+
+        context = torch.multiprocessing.get_context(start_method)
+        self._pool = context.Pool(num_workers, initializer=_init_worker, initargs=(model, threads_per_worker))
+
+    def predict(self, images, batch_size=1, **kwargs):
+        """Takes in a list of images and returns predictions for each,
+        splitting the images into batches that are predicted on by the
+        workers in parallel.
+
+        :param images: A list of images or paths to images to predict on.
+            Images given as paths are read in by the workers.
+        :type images: list
+        :param batch_size: (Optional) The number of images each worker
+            predicts on at once. Defaults to 1.
+        :type batch_size: int
+        :param kwargs: (Optional) Any keyword arguments of
+            :meth:`detecto.core.Model.predict`, such as ``score_threshold``
+            or ``output_format``.
+        :return: A list of the predictions of each image, in the same
+            order as ``images``. See :meth:`detecto.core.Model.predict`.
+        :rtype: list
+        """
+
+        return list(self.imap(images, batch_size, **kwargs))
+
+    def imap(self, images, batch_size=1, **kwargs):
+        """Same as :meth:`detecto.core.InferencePool.predict`, except
+        that ``images`` can be any iterable and that the predictions of
+        each image are yielded in order as soon as they're available.
+
+        :param images: An iterable of images or paths to images.
+        :type images: iterable
+        :param batch_size: (Optional) The number of images each worker
+            predicts on at once. Defaults to 1.
+        :type batch_size: int
+        :param kwargs: (Optional) Any keyword arguments of
+            :meth:`detecto.core.Model.predict`.
+        :return: A generator yielding the predictions of each image.
+        :rtype: generator
+        """
+
+        iterator = iter(images)
+        batches = iter(lambda: list(islice(iterator, batch_size)), [])
+
+        for preds in self._pool.imap(_predict_batch, ((batch, kwargs) for batch in batches)):
+            yield from preds
+
+    def close(self):
+        """Waits for the pending predictions and shuts the workers down."""
+
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.terminate()
+
+
+# The model used by each InferencePool worker process
+_worker_model = None
+
+
+# Sets up an InferencePool worker process
+def _init_worker(model, num_threads):
+    global _worker_model
+    _worker_model = model
+    torch.set_num_threads(num_threads)
+
+
+# Predicts on a batch of images within an InferencePool worker process
+def _predict_batch(args):
+    batch, kwargs = args
+    images = [read_image(img) if isinstance(img, str) else img for img in batch]
+    return _worker_model.predict(images, **kwargs)
+
+
+# Wraps a box predictor to give the classes not in keep (a boolean mask
+# over all classes) a probability of 0, which makes the box head drop
+# their detections along with other low-scoring ones before running NMS.
+# Their probability is folded into the background class so that the
+# softmax scores of the kept classes stay exactly the same.
+class _ClassFilter(torch.nn.Module):
+
+    def __init__(self, predictor, keep):
+        super().__init__()
+        self.predictor = predictor
+        # The background class is never returned, so it's always "kept"
+        self.excluded = ~keep
+        self.excluded[0] = False
+
+    def forward(self, x):
+        class_logits, box_regression = self.predictor(x)
+        excluded = self.excluded.to(class_logits.device)
+
+        background = torch.logsumexp(torch.cat([class_logits[:, :1], class_logits[:, excluded]], dim=1), dim=1)
+        class_logits = class_logits.masked_fill(excluded, float('-inf'))
+        class_logits[:, 0] = background
+        return class_logits, box_regression
+
+
+# Runs an ONNX model exported by Model.export_onnx with ONNX Runtime,
+# taking and returning the same values as the torchvision models
+class _OnnxModel:
+
+    def __init__(self, session):
+        self.session = session
+        self.training = False
+        self._input_name = session.get_inputs()[0].name
+
+    def eval(self):
+        return self
+
+    # The exported model takes one image at a time
+    def __call__(self, images):
+        preds = []
+        for image in images:
+            boxes, labels, scores = self.session.run(None, {self._input_name: image.cpu().numpy()})
+            preds.append({'boxes': torch.from_numpy(boxes), 'labels': torch.from_numpy(labels),
+                          'scores': torch.from_numpy(scores)})
+        return preds
+
+
+# A least recently used cache of decoded images bounded by their total size in bytes
+class _ImageCache:
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+
+    # Returns the cached image, or None if it isn't in the cache
+    def get(self, key):
+        image = self._images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+
+        # Mark the image as the most recently used
+        self._images.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        # Don't let a single image flush out the entire cache
+        if image.nbytes > self.max_size:
+            return
+
+        if key in self._images:
+            self.size -= self._images.pop(key).nbytes
+
+        # Evict the least recently used images until the new one fits
+        while self.size + image.nbytes > self.max_size:
+            _, evicted = self._images.popitem(last=False)
+            self.size -= evicted.nbytes
+
+        self._images[key] = image
+        self.size += image.nbytes
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': self.size,
+                'max_size': self.max_size, 'entries': len(self._images)}
@@ -0,0 +1,279 @@
+import cv2
+import json
+import numpy as np
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class BatchPredictor:
+
+    def __init__(self, model, max_batch_size=8, max_wait=0.005, **kwargs):
+        """Coalesces images submitted concurrently from many threads into
+        batches before feeding them into a model, which gives a much
+        higher throughput than predicting on each image separately. A batch
+        is sent to the model as soon as it holds ``max_batch_size`` images
+        or ``max_wait`` seconds after its first image arrived, whichever
+        comes first, which bounds the latency added by batching.
+
+        :param model: The model to predict with.
+        :type model: detecto.core.Model
+        :param max_batch_size: (Optional) The maximum number of images to
+            feed into the model at once. Defaults to 8.
+        :type max_batch_size: int
+        :param max_wait: (Optional) The maximum number of seconds to wait
+            for more images before predicting on a batch. Defaults to 0.005.
+        :type max_wait: float
+        :param kwargs: (Optional) Any keyword arguments of
+            :meth:`detecto.core.Model.predict` to predict with, such as
+            ``score_threshold``.
+
+        **Example**::
+
+            >>> from concurrent.futures import ThreadPoolExecutor
+            >>> from detecto.core import Model
+            >>> from detecto.server import BatchPredictor
+
+            >>> model = Model.load('model_weights.pth', ['cat', 'dog'])
+            >>> predictor = BatchPredictor(model, max_batch_size=4)
+            >>> with ThreadPoolExecutor(16) as executor:
+            >>>     predictions = list(executor.map(predictor.predict, images))
+            >>> predictor.close()
+        """
+
+        self._model = model
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._kwargs = kwargs
+
+        self._requests = queue.Queue()
+        # Guards _closed so that no image can be queued after the batching
+        # thread has been told to stop
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """Submits an image to be predicted on in the next batch.
+
+        :param image: The image to predict on.
+        :type image: numpy.ndarray or torch.Tensor
+        :return: A future whose result is the image's predictions, in the
+            format returned by :meth:`detecto.core.Model.predict`.
+        :rtype: concurrent.futures.Future
+        :raises RuntimeError: If the predictor has been closed.
+        """
+
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot submit images to a closed BatchPredictor')
+            self._requests.put((image, future))
+        return future
+
+    def predict(self, image):
+        """Same as :meth:`detecto.server.BatchPredictor.submit`, except
+        that it waits for and returns the image's predictions.
+
+        :param image: The image to predict on.
+        :type image: numpy.ndarray or torch.Tensor
+        :return: The image's predictions. See
+            :meth:`detecto.core.Model.predict`.
+        :rtype: tuple
+        """
+
+        return self.submit(image).result()
+
+    def close(self):
+        """Predicts on any remaining images and stops the batching thread.
+        Images can no longer be submitted afterwards.
+        """
+
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._requests.put(None)
+        self._thread.join()
+
+    # Collects requests into batches and predicts on them until closed
+    def _run(self):
+        closed = False
+        while not closed:
+            request = self._requests.get()
+            if request is None:
+                return
+
+            batch = [request]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                try:
+                    request = self._requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    closed = True
+                    break
+                batch.append(request)
+
+            images, futures = zip(*batch)
+            try:
+                preds = self._model.predict(list(images), **self._kwargs)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, pred in zip(futures, preds):
+                future.set_result(pred)
+
+
+def create_server(model, host='127.0.0.1', port=8000, max_batch_size=8, max_wait=0.005, verbose=False):
+    """Creates an HTTP server that runs object detection on the images
+    posted to it, batching concurrent requests together with a
+    :class:`detecto.server.BatchPredictor`. The server has two endpoints:
+
+    * ``POST /predict``: takes an encoded image (e.g. a JPEG or PNG file)
+      as the request body and responds with a JSON object with the
+      ``labels``, ``boxes`` and ``scores`` of its predictions. An optional
+      ``score_threshold`` query parameter filters out lower scoring
+      predictions.
+    * ``GET /health``: responds with ``{"status": "ok"}``.
+
+    Call ``serve_forever`` on the returned server to start handling
+    requests, and ``server_close`` once done with it.
+
+    :param model: The model to predict with.
+    :type model: detecto.core.Model
+    :param host: (Optional) The address to listen on. Defaults to
+        '127.0.0.1', which only accepts local connections.
+    :type host: str
+    :param port: (Optional) The port to listen on, or 0 to pick any free
+        port. Defaults to 8000.
+    :type port: int
+    :param max_batch_size: (Optional) The maximum number of requests to
+        batch together. See :class:`detecto.server.BatchPredictor`.
+        Defaults to 8.
+    :type max_batch_size: int
+    :param max_wait: (Optional) The maximum number of seconds to wait for
+        more requests before predicting on a batch. Defaults to 0.005.
+    :type max_wait: float
+    :param verbose: (Optional) Whether to log every request. Defaults to
+        False.
+    :type verbose: bool
+    :return: The HTTP server.
+    :rtype: http.server.ThreadingHTTPServer
+
+    **Example**::
+
+        >>> from detecto.core import Model
+        >>> from detecto.server import create_server
+
+        >>> model = Model.load('model_weights.pth', ['cat', 'dog'])
+        >>> server = create_server(model, port=8080)
+        >>> server.serve_forever()
+
+        $ curl --data-binary @image.jpg localhost:8080/predict
+        {"labels": ["cat"], "boxes": [[84.2, 31.0, 412.9, 380.5]], "scores": [0.97]}
+    """
+
+    server = _Server((host, port), _RequestHandler)
+    server.predictor = BatchPredictor(model, max_batch_size=max_batch_size, max_wait=max_wait)
+    server.verbose = verbose
+    return server
+
+
+def serve(model, host='127.0.0.1', port=8000, max_batch_size=8, max_wait=0.005, verbose=False):
+    """Serves a model over HTTP until interrupted. Takes the same
+    arguments as :func:`detecto.server.create_server`, and is what the
+    ``detecto serve`` command runs.
+
+    **Example**::
+
+        >>> from detecto.core import Model
+        >>> from detecto.server import serve
+
+        >>> model = Model.load('model_weights.pth', ['cat', 'dog'])
+        >>> serve(model, port=8080, max_batch_size=16)
+    """
+
+    server = create_server(model, host, port, max_batch_size, max_wait, verbose)
+    print(f'Serving on http://{server.server_address[0]}:{server.server_address[1]}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# An HTTP server that also shuts down its BatchPredictor when closed
+class _Server(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def server_close(self):
+        super().server_close()
+        self.predictor.close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._respond(200, {'status': 'ok'})
+        else:
+            self._respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/predict':
+            self._respond(404, {'error': 'Not found'})
+            return
+
+        try:
+            query = parse_qs(url.query)
+            score_threshold = float(query['score_threshold'][0]) if 'score_threshold' in query else None
+
+            length = int(self.headers.get('Content-Length', 0))
+            if length <= 0:
+                raise ValueError('The request body should contain an encoded image')
+
+            body = self.rfile.read(length)
+            image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError('Could not decode the image')
+        except (ValueError, cv2.error) as e:
+            self._respond(400, {'error': str(e)})
+            return
+
+        try:
+            labels, boxes, scores = self.server.predictor.predict(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        except Exception as e:
+            self._respond(500, {'error': str(e)})
+            return
+
+        # Requests are batched together, so each is filtered separately
+        if score_threshold is not None:
+            keep = scores > score_threshold
+            labels = [label for label, kept in zip(labels, keep.tolist()) if kept]
+            boxes, scores = boxes[keep], scores[keep]
+
+        self._respond(200, {'labels': labels, 'boxes': boxes.tolist(), 'scores': scores.tolist()})
+
+    def _respond(self, status, result):
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
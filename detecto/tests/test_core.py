@@ -1,8 +1,13 @@
+import numpy as np
+import pandas as pd
+import pickle
+import pytest
 import torch
 
 from detecto.core import *
-from detecto.utils import read_image
-from .helpers import get_dataset, get_image, get_model, empty_predictor
+from detecto.core import _ClassFilter, _ImageCache
+from detecto.utils import read_image, xml_to_csv
+from .helpers import get_dataset, get_image, get_model, empty_predictor, size_predictor
 from torchvision import transforms
 from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
 
@@ -32,6 +37,17 @@ def test_dataset():
     assert dataset[0][0].shape == (3, 108, 172)
     assert torch.all(dataset[0][1]['boxes'][1] == torch.tensor([6, 41, 171, 107]))
 
+    # Test that a (height, width) resize scales each axis separately
+    transform = transforms.Compose([
+        transforms.ToPILImage(),
+        transforms.Resize((540, 430)),
+        transforms.ToTensor()
+    ])
+
+    dataset = get_dataset(transform=transform)
+    assert dataset[0][0].shape == (3, 540, 430)
+    assert torch.all(dataset[0][1]['boxes'] == torch.tensor([[221, 193, 234, 392], [0, 205, 414, 539]]))
+
     # Test works when given an XML folder
     path = os.path.dirname(__file__)
     input_folder = os.path.join(path, 'static')
@@ -47,6 +63,84 @@ def test_dataset():
     assert 'boxes' in dataset[0][1] and 'labels' in dataset[0][1]
 
 
+# Test that the per-image index handles unordered rows and
+# non-contiguous image_ids
+def test_dataset_index():
+    path = os.path.dirname(__file__)
+    input_folder = os.path.join(path, 'static')
+    labels_path = os.path.join(path, 'static/index_labels.csv')
+
+    df = xml_to_csv(input_folder)
+    second = df.copy()
+    second['image_id'] = 5
+    second['class'] = ['other', 'start_tick']
+    # Interleave the rows of the two images
+    pd.concat([second.iloc[:1], df, second.iloc[1:]]).to_csv(labels_path, index=False)
+
+    dataset = Dataset(labels_path, input_folder)
+    os.remove(labels_path)
+
+    assert len(dataset) == 2
+    assert dataset[0][1]['labels'] == ['start_tick', 'start_gate']
+    assert dataset[1][1]['labels'] == ['other', 'start_tick']
+    assert torch.all(dataset[0][1]['boxes'] == dataset[1][1]['boxes'])
+    assert dataset[1][1]['boxes'].dtype == torch.int64
+
+
+# Test that decoded images are cached and evicted within the byte budget
+def test_dataset_cache():
+    dataset = get_dataset()
+    dataset[0]
+    assert dataset.cache_info() == {'hits': 0, 'misses': 0, 'size': 0, 'max_size': 0, 'entries': 0}
+
+    image_size = 1080 * 1720 * 3
+    dataset = get_dataset(cache_size=image_size)
+    first = dataset[0]
+    second = dataset[0]
+    assert torch.all(first[0] == second[0])
+    assert dataset.cache_info() == {'hits': 1, 'misses': 1, 'size': image_size,
+                                    'max_size': image_size, 'entries': 1}
+
+    # Images larger than the whole budget are never cached
+    dataset = get_dataset(cache_size=image_size - 1)
+    dataset[0]
+    dataset[0]
+    assert dataset.cache_info()['misses'] == 2 and dataset.cache_info()['entries'] == 0
+
+    cache = _ImageCache(10)
+    cache.put('a', np.zeros(4, dtype=np.uint8))
+    cache.put('b', np.zeros(4, dtype=np.uint8))
+    cache.get('a')
+    # 'b' is now the least recently used, so adding 'c' evicts it
+    cache.put('c', np.zeros(4, dtype=np.uint8))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.size == 8
+
+
+# Test that datasets exported to shards load back the same data
+def test_sharded_dataset(tmp_path):
+    dataset = get_dataset()
+    dataset.export_shards(str(tmp_path))
+
+    sharded = ShardedDataset(str(tmp_path))
+    assert len(sharded) == len(dataset)
+    assert torch.all(sharded[0][0] == dataset[0][0])
+    assert torch.all(sharded[0][1]['boxes'] == dataset[0][1]['boxes'])
+    assert sharded[0][1]['labels'] == dataset[0][1]['labels']
+
+    # Resizing on export matches resizing with the dataset's transforms
+    dataset.export_shards(str(tmp_path), size=108)
+    transform = transforms.Compose([transforms.ToPILImage(), transforms.RandomHorizontalFlip(1), transforms.ToTensor()])
+    sharded = ShardedDataset(str(tmp_path), transform=transform)
+    assert sharded[0][0].shape == (3, 108, 172)
+    assert torch.all(sharded[0][1]['boxes'][1] == torch.tensor([7, 41, 172, 107]))
+
+    # Memory maps are reopened rather than copied when pickled
+    assert len(sharded._shards) == 1
+    assert pickle.loads(pickle.dumps(sharded))._shards == {}
+
+
 # Ensure that the collate function of the DataLoader properly
 # converts a list of tuples into a tuple of lists
 def test_collate_fn():
@@ -202,6 +296,352 @@ def test_model_predict():
     assert preds[0][0] == [] and preds[0][1].nelement() == 0 and preds[0][2].nelement() == 0
 
 
+# Test that predicting in batches returns results in the original order
+def test_model_predict_batches():
+    model = get_model()
+    batch_sizes = []
+    model._model.forward = size_predictor(batch_sizes)
+    widths = [30, 10, 40, 20, 50]
+    images = [np.zeros((10 if width % 20 else 20, width, 3), dtype=np.uint8) for width in widths]
+
+    for group_by_size in [False, True]:
+        batch_sizes.clear()
+        preds = model.predict(images, batch_size=2, group_by_size=group_by_size)
+        assert batch_sizes == [2, 2, 1]
+        assert [pred[1][0][2].item() for pred in preds] == widths
+        assert all(pred[0] == ['test1'] for pred in preds)
+
+    batch_sizes.clear()
+    top_preds = model.predict_top(images, batch_size=4)
+    assert batch_sizes == [4, 1]
+    assert [pred[1][0][2].item() for pred in top_preds] == widths
+
+    # Without a batch size, every image is fed in at once
+    batch_sizes.clear()
+    model.predict(images)
+    assert batch_sizes == [5]
+
+
+# Test that predict_iter lazily predicts on paths, arrays and tensors
+def test_model_predict_iter():
+    model = get_model()
+    batch_sizes = []
+    model._model.forward = size_predictor(batch_sizes)
+    path = os.path.join(os.path.dirname(__file__), 'static/image.jpg')
+    images = [path, np.zeros((10, 20, 3), dtype=np.uint8), np.zeros((10, 30, 3), dtype=np.uint8)]
+
+    preds = model.predict_iter(iter(images), batch_size=2)
+    assert batch_sizes == []
+
+    preds = list(preds)
+    assert batch_sizes == [2, 1]
+    assert [pred[1][0][2].item() for pred in preds] == [1720, 20, 30]
+    assert preds[0][0] == ['test1']
+
+    assert list(model.predict_iter([])) == []
+
+
+# Test that tiled predictions are mapped back onto the full image and merged
+def test_model_predict_tiled():
+    model = get_model()
+    batch_sizes = []
+
+    # Predicts a box covering the whole tile and a small box in its corner
+    def predictor(images):
+        batch_sizes.append(len(images))
+        return [{'labels': torch.tensor([1, 2]), 'scores': torch.tensor([0.9, 0.5]),
+                 'boxes': torch.tensor([[0., 0., img.shape[2], img.shape[1]], [0., 0., 4., 4.]])} for img in images]
+
+    model._model.forward = predictor
+    image = np.zeros((100, 150, 3), dtype=np.uint8)
+
+    assert Model._get_tile_offsets(150, 64, 0.25) == [0, 43, 86]
+    assert Model._get_tile_offsets(100, 64, 0.25) == [0, 36]
+    assert Model._get_tile_offsets(50, 64, 0.25) == [0]
+
+    labels, boxes, scores = model.predict_tiled(image, tile_size=64, overlap=0.25, batch_size=4)
+    assert batch_sizes == [4, 2]
+    assert len(labels) == 12 and labels[:6] == ['test1'] * 6
+    assert (scores[:-1] >= scores[1:]).all()
+    assert [0., 0., 64., 64.] in boxes.tolist() and [86., 36., 150., 100.] in boxes.tolist()
+    assert [86., 36., 90., 40.] in boxes.tolist()
+
+    # Overlapping tile-sized boxes now suppress each other, but the
+    # small boxes are only suppressed by boxes with the same label
+    labels, boxes, scores = model.predict_tiled(image, tile_size=(64, 64), overlap=0.25, iou_threshold=0.2)
+    assert labels.count('test1') < 6 and labels.count('test2') == 6
+
+    # Tensors are tiled the same way as arrays
+    _, tensor_boxes, _ = model.predict_tiled(torch.zeros(3, 100, 150), tile_size=(64, 64), overlap=0.25,
+                                             iou_threshold=0.2)
+    assert tensor_boxes.tolist() == boxes.tolist()
+
+    # Tuple sizes are given as (height, width)
+    labels, boxes, scores = model.predict_tiled(image, tile_size=(50, 64), overlap=0.25, iou_threshold=1)
+    assert len(labels) == 18 and [86., 50., 150., 100.] in boxes.tolist()
+
+    for overlap in [-0.1, 1, 1.5]:
+        with pytest.raises(ValueError):
+            model.predict_tiled(image, overlap=overlap)
+
+    model = Model(['test1', 'test2'], pretrained=False)
+    labels, boxes, scores = model.predict_tiled(get_image()[::4, ::4].copy(), tile_size=200, score_threshold=0.1)
+    assert len(labels) == len(boxes) == len(scores) and (scores > 0.1).all()
+
+
+# Test that predictions can be returned as label ids or structured arrays
+def test_model_predict_formats():
+    model = get_model()
+
+    def predictor(images):
+        return [{'labels': torch.tensor([2, 1, 2]), 'boxes': torch.arange(12.).reshape(3, 4),
+                 'scores': torch.tensor([0.9, 0.8, 0.7])} for _ in images]
+
+    model._model.forward = predictor
+    image = np.zeros((10, 20, 3), dtype=np.uint8)
+    assert model.classes == ['__background__', 'test1', 'test2', 'test3']
+
+    labels, boxes, scores = model.predict(image, output_format=Model.LABEL_IDS)
+    assert torch.equal(labels, torch.tensor([2, 1, 2]))
+    assert [model.classes[i] for i in labels] == model.predict(image)[0]
+
+    preds = model.predict([image, image], output_format=Model.ARRAY)
+    assert len(preds) == 2 and preds[0].dtype == Model.PREDICTION_DTYPE
+    assert preds[0]['label'].tolist() == [2, 1, 2]
+    assert preds[0]['x2'].tolist() == [2., 6., 10.]
+    assert np.allclose(preds[0]['score'], [0.9, 0.8, 0.7])
+
+    preds = list(model.predict_iter([image], output_format=Model.ARRAY))
+    assert preds[0]['label'].tolist() == [2, 1, 2]
+
+    labels, boxes, scores = model.predict_top(image, output_format=Model.LABEL_IDS)
+    assert labels.tolist() == [2, 1] and boxes[:, 0].tolist() == [0., 4.]
+    preds = model.predict_top([image], output_format=Model.ARRAY)
+    assert preds[0]['label'].tolist() == [2, 1] and preds[0]['y1'].tolist() == [1., 5.]
+
+    with pytest.raises(ValueError):
+        model.predict(image, output_format='strings')
+
+
+# Test that a pool of worker processes predicts the same as the model
+def test_inference_pool():
+    model = Model(['test1', 'test2'], pretrained=False, device=torch.device('cpu'), min_size=100, max_size=200)
+    path = os.path.join(os.path.dirname(__file__), 'static/image.jpg')
+    images = [get_image()[::8, ::8].copy(), path, np.zeros((50, 60, 3), dtype=np.uint8)]
+    arrays = [read_image(img) if isinstance(img, str) else img for img in images]
+    expected = model.predict(arrays[:2]) + model.predict(arrays[2:])
+
+    with InferencePool(model, num_workers=2, threads_per_worker=1) as pool:
+        assert all(param.is_shared() for param in model.get_internal_model().parameters())
+        preds = pool.predict(images, batch_size=2, output_format=Model.LABEL_IDS)
+        assert len(list(pool.imap(iter(images)))) == 3
+
+    assert len(preds) == 3
+    for (labels, boxes, scores), (expected_labels, expected_boxes, expected_scores) in zip(preds, expected):
+        assert len(labels) == len(expected_labels) and boxes.shape == expected_boxes.shape
+        assert torch.allclose(scores, expected_scores, atol=1e-4)
+
+    model._device = torch.device('cuda')
+    with pytest.raises(ValueError):
+        InferencePool(model)
+
+
+# Test that quantizing the model swaps in int8 modules and still predicts
+def test_model_quantize():
+    model = Model(['test1', 'test2', 'test3'], device=torch.device('cpu'))
+    image = np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)
+
+    model.quantize(Dataset(os.path.join(os.path.dirname(__file__), 'static')), num_calibration_images=1)
+    roi_heads = model._model.roi_heads
+    assert isinstance(roi_heads.box_head.fc6, torch.nn.quantized.dynamic.Linear)
+    assert isinstance(roi_heads.box_predictor.cls_score, torch.nn.quantized.dynamic.Linear)
+    assert isinstance(model._model.backbone.body, torch.fx.GraphModule)
+
+    labels, boxes, scores = model.predict(image)
+    assert boxes.shape == (len(labels), 4) and scores.shape == (len(labels),)
+
+    # Without calibration data, only the box head is quantized
+    model = Model(['test1', 'test2', 'test3'], device=torch.device('cpu'))
+    model.quantize()
+    assert isinstance(model._model.roi_heads.box_head.fc7, torch.nn.quantized.dynamic.Linear)
+    assert not isinstance(model._model.backbone.body, torch.fx.GraphModule)
+    model.predict([image, image])
+
+    with pytest.raises(ValueError):
+        model.save('model.pth')
+    assert not os.path.exists('model.pth')
+
+    # Calibration images are read without the dataset's transforms
+    dataset = Dataset(os.path.join(os.path.dirname(__file__), 'static'))
+    for data in [dataset, DataLoader(dataset, batch_size=2)]:
+        batches = list(Model._get_calibration_batches(data, 1))
+        assert len(batches) == 1 and len(batches[0]) == 1
+        assert isinstance(batches[0][0], np.ndarray) and batches[0][0].dtype == np.uint8
+
+
+# Test that TorchScript models predict the same as the original model
+def test_model_torchscript(tmp_path):
+    file = str(tmp_path / 'model.pt')
+    image = get_image()[::4, ::4].copy()
+    model = Model(device=torch.device('cpu'))
+    # Torchvision interpolates slightly differently when scripted, so
+    # predict at the image's own size, where it isn't resized at all
+    model.get_internal_model().transform.min_size = (min(image.shape[:2]),)
+
+    model.export_torchscript(file)
+    expected = model.predict(image)
+
+    scripted = Model.load_scripted(file, optimize=False)
+    assert scripted._classes == model._classes
+    assert isinstance(scripted.get_internal_model(), torch.jit.ScriptModule)
+
+    labels, boxes, scores = scripted.predict(image)
+    assert labels == expected[0]
+    assert torch.allclose(boxes, expected[1], atol=1e-3)
+    assert torch.allclose(scores, expected[2], atol=1e-4)
+
+    # The saved classes can be renamed when loading
+    classes = [label.upper() for label in model._classes[1:]]
+    scripted = Model.load_scripted(file, classes=classes)
+    assert scripted._classes == ['__background__'] + classes
+    preds = scripted.predict([image, image])
+    assert len(preds) == 2 and preds[0][0] == [label.upper() for label in expected[0]]
+
+
+# Test that ONNX models predict the same as the original model
+def test_model_onnx(tmp_path):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+
+    file = str(tmp_path / 'model.onnx')
+    model = Model(device=torch.device('cpu'))
+    image = get_image()[::4, ::4].copy()
+
+    model.export_onnx(file)
+    expected = model.predict(image)
+
+    onnx_model = Model.load_onnx(file, num_threads=2)
+    assert onnx_model._classes == model._classes
+
+    labels, boxes, scores = onnx_model.predict(image)
+    assert labels == expected[0]
+    assert torch.allclose(boxes, expected[1], atol=1e-2)
+    assert torch.allclose(scores, expected[2], atol=1e-4)
+
+    classes = [label.upper() for label in model._classes[1:]]
+    preds = Model.load_onnx(file, classes=classes).predict([image, image[:100]])
+    assert len(preds) == 2 and all(label in classes for label in preds[1][0])
+
+
+# Test that the inference path returns ordinary CPU tensors
+# and only switches the model to eval mode when needed
+def test_model_predict_outputs():
+    model = get_model()
+    eval_calls = []
+    eval = model._model.eval
+    model._model.eval = lambda: eval_calls.append(1) or eval()
+
+    model._model.train()
+    model._model.forward = lambda images: [{'labels': torch.tensor([1, 2]), 'boxes': torch.ones(2, 4),
+                                            'scores': torch.tensor([0.9, 0.8])} for _ in images]
+    preds = model.predict([get_image(), get_image()])
+    model.predict(get_image())
+    assert len(eval_calls) == 1
+
+    assert preds[1][0] == ['test1', 'test2']
+    assert not preds[0][1].is_inference()
+    assert preds[0][1].device == torch.device('cpu')
+    # Results can be modified in place without affecting each other
+    boxes = preds[0][1]
+    boxes *= 2
+    assert torch.all(preds[1][1] == 1)
+
+
+# Test that presets and explicit options configure the internal model
+def test_model_presets(tmp_path):
+    presets = Model.PRESETS[Model.DEFAULT]
+    model = Model(['test1'], pretrained=False, preset=Model.FAST, min_size=400, box_score_thresh=0.5)
+    internal = model.get_internal_model()
+    assert internal.transform.min_size == (400,)
+    assert internal.transform.max_size == presets[Model.FAST]['max_size']
+    assert internal.rpn._pre_nms_top_n['testing'] == presets[Model.FAST]['rpn_pre_nms_top_n_test']
+    assert internal.rpn._post_nms_top_n['testing'] == presets[Model.FAST]['rpn_post_nms_top_n_test']
+    assert internal.roi_heads.detections_per_img == presets[Model.FAST]['box_detections_per_img']
+    assert internal.roi_heads.score_thresh == 0.5
+
+    file = str(tmp_path / 'model.pth')
+    model.save(file)
+    model = Model.load(file, ['test1'], preset=Model.ACCURATE, box_detections_per_img=50)
+    assert model.get_internal_model().transform.min_size == (presets[Model.ACCURATE]['min_size'],)
+    assert model.get_internal_model().roi_heads.detections_per_img == 50
+
+    with pytest.raises(ValueError):
+        Model(['test1'], preset='fastest')
+
+
+# Test that presets are relative to the chosen model's own defaults
+def test_model_presets_mobilenet_320():
+    default = Model(['test1'], pretrained=False, model_name=Model.MOBILENET_320).get_internal_model()
+    for preset in [Model.FAST, Model.BALANCED, Model.ACCURATE]:
+        internal = Model(['test1'], pretrained=False, model_name=Model.MOBILENET_320, preset=preset).get_internal_model()
+        options = Model.PRESETS[Model.MOBILENET_320][preset]
+        assert internal.transform.min_size == (options['min_size'],)
+        assert internal.rpn._pre_nms_top_n['testing'] == options['rpn_pre_nms_top_n_test']
+
+        if preset == Model.FAST:
+            assert internal.transform.min_size[0] < default.transform.min_size[0]
+            assert internal.transform.max_size < default.transform.max_size
+            assert internal.rpn._pre_nms_top_n['testing'] < default.rpn._pre_nms_top_n['testing']
+            assert internal.rpn._post_nms_top_n['testing'] < default.rpn._post_nms_top_n['testing']
+        elif preset == Model.BALANCED:
+            assert internal.transform.min_size == default.transform.min_size
+            assert internal.transform.max_size == default.transform.max_size
+            assert internal.rpn._pre_nms_top_n == default.rpn._pre_nms_top_n
+            assert internal.rpn._post_nms_top_n == default.rpn._post_nms_top_n
+
+
+# Test that predictions can be filtered by score and class, inside the
+# model when possible and afterwards otherwise
+def test_model_predict_filters():
+    image = get_image()
+    model = Model(['test1', 'test2', 'test3'], pretrained=False, box_score_thresh=0.0)
+    roi_heads = model.get_internal_model().roi_heads
+    predictor = roi_heads.box_predictor
+
+    labels, boxes, scores = model.predict(image)
+    filtered_labels, filtered_boxes, filtered_scores = model.predict(image, score_threshold=0.3, classes=['test2'])
+    assert set(filtered_labels) <= {'test2'}
+    assert (filtered_scores > 0.3).all()
+    # The model's own postprocessing settings are restored afterwards
+    assert roi_heads.score_thresh == 0.0 and roi_heads.box_predictor is predictor
+
+    # A lower threshold doesn't loosen the model's own one
+    roi_heads.score_thresh = 0.3
+    labels, boxes, scores = model.predict(image, score_threshold=0.01)
+    assert torch.equal(scores, model.predict(image)[2]) and (scores > 0.3).all()
+    roi_heads.score_thresh = 0.0
+
+    # Excluded classes get a score of 0 while kept ones are unchanged
+    features = torch.rand(5, predictor.cls_score.in_features)
+    class_filter = _ClassFilter(predictor, torch.tensor([False, True, False, True]))
+    expected = torch.softmax(predictor(features)[0], -1)
+    probabilities = torch.softmax(class_filter(features)[0], -1)
+    assert torch.allclose(probabilities[:, [1, 3]], expected[:, [1, 3]], atol=1e-6)
+    assert (probabilities[:, 2] == 0).all()
+
+    # Models that can't be configured are filtered after the fact
+    model._model = lambda images: [{'labels': torch.tensor([1, 2, 3]), 'boxes': torch.rand(3, 4),
+                                    'scores': torch.tensor([0.9, 0.8, 0.2])} for _ in images]
+    labels, boxes, scores = model.predict(image, score_threshold=0.5, classes=['test1', 'test3'])
+    assert labels == ['test1'] and boxes.shape == (1, 4) and torch.equal(scores, torch.tensor([0.9]))
+
+    labels, boxes, scores = model.predict_top([image], classes=['test3'])[0]
+    assert labels == ['test3']
+
+    with pytest.raises(ValueError):
+        model.predict(image, classes=['test4'])
+
+
 # Test that save, load, and get_internal_model all work properly
 def test_model_helpers():
     path = os.path.dirname(__file__)
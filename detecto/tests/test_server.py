@@ -0,0 +1,77 @@
+import cv2
+import json
+import numpy as np
+import pytest
+import threading
+import urllib.error
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from .helpers import get_image, get_model, size_predictor
+from detecto.server import *
+
+
+# Predicts two boxes of each image's size, scoring 0.9 and 0.4
+def get_batching_model(batch_sizes):
+    model = get_model()
+    model._model.forward = size_predictor(batch_sizes, labels=[1, 2], scores=[0.9, 0.4])
+    return model
+
+
+def test_batch_predictor():
+    batch_sizes = []
+    predictor = BatchPredictor(get_batching_model(batch_sizes), max_batch_size=4, max_wait=0.5)
+    images = [np.zeros((10, width, 3), dtype=np.uint8) for width in range(10, 70, 10)]
+
+    with ThreadPoolExecutor(len(images)) as executor:
+        preds = list(executor.map(predictor.predict, images))
+
+    # Requests are batched together, but each gets its own predictions
+    assert sum(batch_sizes) == 6 and max(batch_sizes) == 4
+    assert [pred[1][0][2].item() for pred in preds] == list(range(10, 70, 10))
+    assert preds[0][0] == ['test1', 'test2']
+
+    future = predictor.submit(images[0])
+    predictor.close()
+    assert future.result()[0] == ['test1', 'test2']
+
+    with pytest.raises(RuntimeError):
+        predictor.submit(images[0])
+
+
+def test_server():
+    batch_sizes = []
+    server = create_server(get_batching_model(batch_sizes), port=0, max_batch_size=8, max_wait=0.5)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}'.format(*server.server_address)
+
+    def post(data, query=''):
+        request = urllib.request.Request(url + '/predict' + query, data=data, method='POST')
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    try:
+        with urllib.request.urlopen(url + '/health') as response:
+            assert json.loads(response.read()) == {'status': 'ok'}
+
+        image = cv2.imencode('.png', get_image()[:100, :200])[1].tobytes()
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(post, [image] * 4))
+
+        assert max(batch_sizes) > 1
+        assert results[0] == {'labels': ['test1', 'test2'], 'boxes': [[0, 0, 200, 100]] * 2,
+                              'scores': pytest.approx([0.9, 0.4])}
+
+        assert post(image, '?score_threshold=0.5')['labels'] == ['test1']
+
+        for data in [b'not an image', b'']:
+            with pytest.raises(urllib.error.HTTPError) as e:
+                post(data)
+            assert e.value.code == 400
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url + '/unknown')
+        assert e.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
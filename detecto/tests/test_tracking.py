@@ -0,0 +1,56 @@
+import torch
+
+from detecto.tracking import Tracker
+
+
+def test_tracker():
+    tracker = Tracker(iou_threshold=0.3, max_age=1, smoothing=0)
+
+    # A car moving right by 10 pixels per frame and a static person
+    def detections(frame):
+        return ['car', 'person'], torch.tensor([[10. * frame, 0, 10. * frame + 100, 50], [300, 300, 350, 400]]), \
+            torch.tensor([0.9, 0.8])
+
+    labels, boxes, scores, ids = tracker.update(*detections(0))
+    assert labels == ['car', 'person'] and ids.tolist() == [0, 1]
+
+    # Without any motion seen yet, boxes stay in place
+    labels, boxes, scores, ids = tracker.predict()
+    assert torch.equal(boxes, detections(0)[1]) and ids.tolist() == [0, 1]
+    tracker.predict()
+
+    # Detections are matched to their tracks even when listed in another order
+    labels, boxes, scores, ids = tracker.update(['person', 'car'], detections(3)[1].flip(0), torch.tensor([0.7, 0.9]))
+    assert labels == ['car', 'person'] and ids.tolist() == [0, 1]
+
+    # Boxes then move along each track's velocity
+    labels, boxes, scores, ids = tracker.predict()
+    assert torch.allclose(boxes, detections(4)[1])
+    assert torch.equal(scores, torch.tensor([0.9, 0.7]))
+
+    # Held tracks go back to where they were last detected and stop moving
+    labels, boxes, scores, ids = tracker.hold()
+    assert torch.equal(boxes, detections(3)[1]) and ids.tolist() == [0, 1]
+    labels, boxes, scores, ids = tracker.predict()
+    assert torch.equal(boxes, detections(3)[1])
+
+
+def test_tracker_new_and_lost_tracks():
+    tracker = Tracker(max_age=1)
+    box = torch.tensor([[0., 0, 10, 10]])
+
+    tracker.update(['a'], box, torch.tensor([0.9]))
+    # A detection of another label in the same place starts a new track
+    labels, boxes, scores, ids = tracker.update(['b'], box, torch.tensor([0.9]))
+    assert labels == ['b'] and ids.tolist() == [1]
+
+    # Missing tracks aren't shown, but can be matched again for max_age keyframes
+    labels, boxes, scores, ids = tracker.update([], torch.empty(0, 4), torch.empty(0))
+    assert labels == [] and len(tracker.predict()[0]) == 0
+    labels, boxes, scores, ids = tracker.update(['b'], box, torch.tensor([0.9]))
+    assert ids.tolist() == [1]
+
+    tracker.update([], torch.empty(0, 4), torch.empty(0))
+    tracker.update([], torch.empty(0, 4), torch.empty(0))
+    labels, boxes, scores, ids = tracker.update(torch.tensor([2]), box, torch.tensor([0.9]))
+    assert labels == [2] and ids.tolist() == [2]
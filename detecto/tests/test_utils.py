@@ -1,12 +1,17 @@
+import cv2
+import numpy as np
 import os
 import pandas as pd
 import pytest
+import threading
+import time
 import torch
 import torchvision
 
 from .helpers import get_image
 from detecto.utils import *
-from detecto.utils import _is_iterable
+from detecto.core import Dataset
+from detecto.utils import _is_iterable, _read_labels, _run_pipeline
 
 
 def test_filter_top_predictions():
@@ -28,6 +33,34 @@ def test_filter_top_predictions():
     # Correct scores
     assert {preds[2][0].item(), preds[2][1].item()} == {5, 4}
 
+    # Results are sorted by score, and work with integer label ids too
+    assert preds[0] == ['test1', 'test2']
+    preds = filter_top_predictions(torch.tensor([2, 1, 1, 2, 3]), boxes, torch.tensor([1., 4, 5, 3, 2]))
+    assert preds[0].tolist() == [1, 2, 3] and preds[2].tolist() == [5, 3, 2]
+    assert preds[1][:, 0].tolist() == [2, 3, 4]
+
+    preds = filter_top_predictions([], torch.empty(0, 4), torch.empty(0))
+    assert preds[0] == [] and preds[1].shape == (0, 4) and len(preds[2]) == 0
+
+
+def test_filter_top_predictions_batch():
+    boxes = torch.arange(20.).reshape(5, 4)
+    predictions = [(['a', 'b', 'a'], boxes[:3], torch.tensor([0.5, 0.9, 0.7])),
+                   ([], torch.empty(0, 4), torch.empty(0)),
+                   (['b', 'b'], boxes[3:], torch.tensor([0.6, 0.6]))]
+
+    preds = filter_top_predictions_batch(predictions)
+    assert len(preds) == 3
+    assert preds[0][0] == ['b', 'a'] and torch.equal(preds[0][1], boxes[[1, 2]])
+    assert preds[1][0] == [] and preds[1][1].shape == (0, 4)
+    # Ties go to the first prediction
+    assert preds[2][0] == ['b'] and torch.equal(preds[2][1], boxes[[3]])
+
+    for pred, expected in zip(preds, predictions):
+        assert pred[0] == filter_top_predictions(*expected)[0]
+
+    assert filter_top_predictions_batch([]) == []
+
 
 def test_default_transforms():
     transforms = default_transforms()
@@ -95,6 +128,35 @@ def test_split_video():
     os.rmdir(output_path)
 
 
+def test_split_video_sampling(tmp_path):
+    # Each frame's brightness is 10 times its index
+    video_file = str(tmp_path / 'video.avi')
+    writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*'MJPG'), 10, (32, 24))
+    for i in range(20):
+        writer.write(np.full((24, 32, 3), i * 10, dtype=np.uint8))
+    writer.release()
+
+    def saved_frames(folder):
+        files = sorted(os.listdir(folder), key=lambda f: int(f[5:-4]))
+        return [round(cv2.imread(os.path.join(folder, f)).mean() / 10) for f in files]
+
+    for i, num_workers in enumerate([0, 3]):
+        folder = tmp_path / f'step{i}'
+        folder.mkdir()
+        assert split_video(video_file, str(folder), step_size=3, num_threads=2, num_workers=num_workers) == 7
+        assert saved_frames(folder) == [0, 3, 6, 9, 12, 15, 18]
+
+    # 4 frames per second of a 10 FPS video
+    for i, num_workers in enumerate([0, 2]):
+        folder = tmp_path / f'fps{i}'
+        folder.mkdir()
+        assert split_video(video_file, str(folder), fps=4, num_workers=num_workers) == 8
+        assert saved_frames(folder) == [0, 3, 5, 8, 10, 13, 15, 18]
+
+    with pytest.raises(ValueError):
+        split_video(video_file, str(tmp_path), fps=0)
+
+
 def test_xml_to_csv():
     path = os.path.dirname(__file__)
     input_folder = os.path.join(path, 'static')
@@ -118,6 +180,86 @@ def test_xml_to_csv():
     assert not os.path.isfile(output_path)
 
 
+def test_xml_to_csv_parallel_and_incremental(tmp_path):
+    path = os.path.dirname(__file__)
+    with open(os.path.join(path, 'static/label.xml')) as f:
+        xml = f.read()
+
+    # Give each file a distinct label so its rows can be identified
+    def write_xml(i):
+        with open(str(tmp_path / 'label{}.xml'.format(i)), 'w') as f:
+            f.write(xml.replace('start_tick', 'tick{}'.format(i)))
+
+    for i in range(4):
+        write_xml(i)
+
+    serial = xml_to_csv(str(tmp_path))
+    parallel = xml_to_csv(str(tmp_path), num_workers=2, chunk_size=1)
+    assert serial.equals(parallel)
+    assert len(parallel) == 8 and set(parallel['image_id']) == {0, 1, 2, 3}
+
+    cache_file = str(tmp_path / 'cache.pkl')
+    df = xml_to_csv(str(tmp_path), cache_file=cache_file)
+    ids = dict(zip(df['class'], df['image_id']))
+    assert os.path.isfile(cache_file)
+
+    # Remove a file and add another; the remaining files keep their
+    # image_ids and the new file doesn't reuse the removed file's
+    os.remove(str(tmp_path / 'label0.xml'))
+    write_xml(4)
+    df = xml_to_csv(str(tmp_path), cache_file=cache_file)
+    updated_ids = dict(zip(df['class'], df['image_id']))
+
+    assert len(df) == 8 and 'tick0' not in updated_ids
+    assert all(updated_ids['tick{}'.format(i)] == ids['tick{}'.format(i)] for i in range(1, 4))
+    assert updated_ids['tick4'] == 4
+    assert list(df['image_id']) == sorted(df['image_id'])
+
+    # Nothing changed, so the cached table is returned as is
+    assert xml_to_csv(str(tmp_path), cache_file=cache_file).equals(df)
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet', '.feather'])
+def test_label_file_formats(tmp_path, extension):
+    path = os.path.dirname(__file__)
+    input_folder = os.path.join(path, 'static')
+    output_path = str(tmp_path / ('labels' + extension))
+
+    df = xml_to_csv(input_folder, output_path)
+    assert df['class'].dtype == 'category' and df['xmin'].dtype == 'int32'
+
+    labels = _read_labels(output_path)
+    assert labels.equals(df)
+    assert list(labels['class']) == ['start_tick', 'start_gate']
+
+    dataset = Dataset(output_path, input_folder)
+    assert dataset[0][1]['labels'] == ['start_tick', 'start_gate']
+    assert torch.all(dataset[0][1]['boxes'][0] == torch.tensor([884, 387, 937, 784]))
+
+
+def test__run_pipeline():
+    stages = [lambda x: x + 1, lambda x: x * 2]
+    assert list(_run_pipeline(range(10), stages, queue_size=1)) == [(i + 1) * 2 for i in range(10)]
+    assert list(_run_pipeline([], stages)) == []
+
+    # Errors in any stage are raised to the caller
+    def fail(x):
+        if x == 3:
+            raise KeyError('failed')
+        return x
+
+    with pytest.raises(KeyError):
+        list(_run_pipeline(range(10), [fail, lambda x: x]))
+
+    # Stopping early stops the stage threads too
+    threads = threading.active_count()
+    outputs = _run_pipeline(iter(range(1000)), stages)
+    assert next(outputs) == 2
+    outputs.close()
+    time.sleep(0.5)
+    assert threading.active_count() == threads
+
+
 def test__is_iterable():
     test1 = [1, 2]
     test2 = (3, 4)
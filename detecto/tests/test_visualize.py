@@ -1,7 +1,14 @@
+import json
+import numpy as np
 import os
+import pandas as pd
+import pytest
 
 from .helpers import get_image, get_model, empty_predictor
 from detecto.visualize import *
+from detecto.tracking import Tracker
+from detecto.visualize import _DetectionWriter, _KeyframeSelector, _prepare_frame, _scaled_model, \
+    _track_predictions
 
 
 def test_detect_video():
@@ -10,9 +17,11 @@ def test_detect_video():
     output_video = os.path.join(path, 'static/output_video.avi')
 
     model = get_model()
-    detect_video(model, input_video, output_video)
+    stats = detect_video(model, input_video, output_video, batch_size=2)
 
     assert os.path.isfile(output_video)
+    assert stats['frames'] > 0 and stats['fps'] > 0
+    assert cv2.VideoCapture(output_video).get(cv2.CAP_PROP_FRAME_COUNT) == stats['frames']
     os.remove(output_video)
 
     # Ensure it works when the model makes no predictions
@@ -22,6 +31,180 @@ def test_detect_video():
     assert os.path.isfile(output_video)
     os.remove(output_video)
 
+    # Frames are scaled down before being fed into the model
+    sizes = []
+
+    def predictor(images):
+        sizes.extend(image.shape[1:] for image in images)
+        return empty_predictor(images)
+
+    model._model.forward = predictor
+    detect_video(model, input_video, output_video, scaled_size=400)
+    assert min(sizes[0]) == 400
+    os.remove(output_video)
+
+    # Only keyframes are fed into the model
+    sizes.clear()
+    stats = detect_video(model, input_video, output_video, keyframe_interval=3, scene_threshold=1.0)
+    assert stats['keyframes'] == len(sizes) == len(range(0, stats['frames'], 3))
+    os.remove(output_video)
+
+    stats = detect_video(model, input_video, output_video, motion_threshold=1.0)
+    assert stats['keyframes'] + stats['skipped'] == stats['frames']
+    os.remove(output_video)
+
+
+@pytest.mark.parametrize('extension', ['.jsonl', '.csv', '.parquet'])
+def test_export_video_detections(tmp_path, extension):
+    if extension == '.parquet':
+        pytest.importorskip('pyarrow')
+
+    path = os.path.dirname(__file__)
+    input_video = os.path.join(path, 'static/input_video.mp4')
+    output_file = str(tmp_path / ('detections' + extension))
+
+    model = get_model()
+    model._model.forward = lambda images: [{'labels': torch.tensor([1]), 'boxes': torch.tensor([[0., 0, 10, 10]]),
+                                            'scores': torch.tensor([0.9])} for _ in images]
+
+    stats = export_video_detections(model, input_video, output_file, scaled_size=None)
+    assert stats['frames'] > 0 and stats['detections'] == stats['frames']
+
+    if extension == '.jsonl':
+        with open(output_file) as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == stats['frames']
+        assert records[0] == {'frame': 0, 'timestamp': 0.0, 'labels': ['test1'], 'boxes': [[0, 0, 10, 10]],
+                              'scores': [pytest.approx(0.9)]}
+    else:
+        df = pd.read_csv(output_file) if extension == '.csv' else pd.read_parquet(output_file)
+        assert len(df) == stats['frames']
+        assert list(df.columns) == ['frame', 'timestamp', 'label', 'x1', 'y1', 'x2', 'y2', 'score']
+        assert df['label'][0] == 'test1' and df['x2'][0] == 10
+
+    # Track IDs are included when tracking
+    export_video_detections(model, input_video, output_file, keyframe_interval=2)
+    if extension == '.jsonl':
+        with open(output_file) as f:
+            assert json.loads(f.readline())['ids'] == [0]
+    else:
+        df = pd.read_csv(output_file) if extension == '.csv' else pd.read_parquet(output_file)
+        assert df['track_id'][0] == 0
+
+    with pytest.raises(ValueError):
+        export_video_detections(model, input_video, str(tmp_path / 'detections.txt'))
+
+
+def test__detection_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(_DetectionWriter, '_CHUNK_SIZE', 3)
+    file = str(tmp_path / 'detections.csv')
+
+    writer = _DetectionWriter(file, tracks=False)
+    for frame in range(5):
+        writer.write(frame, frame / 30, ['a', 'b'], torch.ones(2, 4) * frame, torch.tensor([0.5, 0.6]))
+    writer.write(5, 5 / 30, [], torch.empty(0, 4), torch.empty(0))
+    writer.close()
+
+    df = pd.read_csv(file)
+    assert writer.num_detections == 10 and len(df) == 10
+    assert df['frame'].tolist() == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4]
+
+    # Files are still written without any detections
+    writer = _DetectionWriter(file, tracks=True)
+    writer.close()
+    assert list(pd.read_csv(file).columns) == ['frame', 'timestamp', 'label', 'track_id', 'x1', 'y1', 'x2', 'y2',
+                                                'score']
+
+    # Unknown timestamps are written as null or NaN
+    for extension in ['.jsonl', '.csv']:
+        file = str(tmp_path / ('detections' + extension))
+        writer = _DetectionWriter(file, tracks=False)
+        writer.write(0, None, ['a'], torch.ones(1, 4), torch.tensor([0.5]))
+        writer.close()
+
+        if extension == '.jsonl':
+            with open(file) as f:
+                assert json.loads(f.readline())['timestamp'] is None
+        else:
+            assert pd.read_csv(file)['timestamp'].isna().all()
+
+
+def test__prepare_frame():
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    frame[..., 0] = 255
+
+    image, scale = _prepare_frame(frame, 800)
+    assert image.shape == (800, 1422, 3)
+    # Converted from BGR to RGB
+    assert (image[..., 2] == 255).all() and (image[..., 0] == 0).all()
+    assert torch.allclose(torch.tensor([0., 0., 1422., 800.]) * scale, torch.tensor([0., 0., 1920., 1080.]))
+
+    # Frames are never scaled up
+    image, scale = _prepare_frame(frame, 2000)
+    assert image.shape == frame.shape and torch.equal(scale, torch.ones(4))
+    assert _prepare_frame(frame)[0].shape == frame.shape
+
+
+# Test that the model runs at the scaled size for the duration of a video
+def test__scaled_model():
+    model = get_model()
+    transform = model.get_internal_model().transform
+    assert transform.min_size == (800,) and transform.max_size == 1333
+
+    with _scaled_model(model, 400):
+        assert transform.min_size == (400,) and transform.max_size == 666
+    assert transform.min_size == (800,) and transform.max_size == 1333
+
+    # Models are never set to run at a larger size than their own
+    for scaled_size in [None, 800, 1000]:
+        with _scaled_model(model, scaled_size):
+            assert transform.min_size == (800,) and transform.max_size == 1333
+
+
+def test__keyframe_selector():
+    keyframe, track, hold = _KeyframeSelector.KEYFRAME, _KeyframeSelector.TRACK, _KeyframeSelector.HOLD
+    frame = np.zeros((90, 160, 3), dtype=np.uint8)
+    selector = _KeyframeSelector(keyframe_interval=3)
+    assert [selector.select(frame) for _ in range(7)] == [keyframe, track, track, keyframe, track, track, keyframe]
+    assert selector.tracks and not _KeyframeSelector().tracks
+
+    # Scene changes also start a new keyframe
+    selector = _KeyframeSelector(keyframe_interval=10, scene_threshold=0.1)
+    changed = np.full_like(frame, 255)
+    assert [selector.select(f) for f in [frame, frame, changed, changed, frame]] == \
+        [keyframe, track, keyframe, track, keyframe]
+
+    # Static frames are skipped, with the skipped forward passes counted
+    selector = _KeyframeSelector(motion_threshold=0.05)
+    noisy = frame + 5
+    assert [selector.select(f) for f in [frame, noisy, frame, changed, changed]] == \
+        [keyframe, hold, hold, keyframe, hold]
+    assert selector.skipped == 3 and not selector.tracks
+
+
+# Test that tracks stop moving once the motion check finds nothing moved,
+# instead of drifting along their last velocity
+def test__keyframe_selector_motion_with_tracking():
+    selector = _KeyframeSelector(keyframe_interval=2, motion_threshold=0.01)
+    tracker = Tracker(smoothing=0)
+    frame = np.zeros((90, 160, 3), dtype=np.uint8)
+
+    # An object moves right by 10 pixels per frame for a few frames, then stops
+    xs = [10 * min(i, 4) for i in range(200)]
+    decisions, boxes = [], []
+    for x in xs:
+        frame = np.zeros((90, 160, 3), dtype=np.uint8)
+        frame[20:40, x:x + 20] = 255
+        decision = selector.select(frame)
+        box = torch.tensor([[x, 20., x + 20, 40]])
+        predictions = (['a'], box, torch.tensor([0.9])) if decision == _KeyframeSelector.KEYFRAME else None
+        decisions.append(decision)
+        boxes.append(_track_predictions(tracker, decision, predictions)[1])
+
+    assert _KeyframeSelector.HOLD in decisions and selector.skipped > 0
+    assert all(len(b) == 1 and 0 <= b[0, 0] <= 160 for b in boxes)
+    assert boxes[-1].tolist() == [[40., 20., 60., 40.]]
+
 
 def test_plot_prediction_grid():
     model = get_model()
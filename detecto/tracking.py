@@ -0,0 +1,190 @@
+import torch
+
+from torchvision.ops import box_iou
+
+
+class Tracker:
+
+    def __init__(self, iou_threshold=0.3, max_age=1, smoothing=0.5):
+        """Tracks detected objects across the frames of a video, giving
+        each one a stable ID. This makes it possible to run the detector
+        only on some (key) frames and cheaply fill in the frames in between:
+        each track moves at a constant velocity estimated from its past
+        detections, and new detections are matched to the tracks' predicted
+        boxes by IoU.
+
+        Call :meth:`detecto.tracking.Tracker.update` with the predictions
+        on each keyframe and :meth:`detecto.tracking.Tracker.predict` on
+        every other frame (or :meth:`detecto.tracking.Tracker.hold` on
+        frames where nothing moved), exactly once per frame and in order.
+
+        :param iou_threshold: (Optional) The minimum IoU between a
+            detection and a track's predicted box for the two to be
+            matched. Only detections and tracks of the same label are
+            matched. Defaults to 0.3.
+        :type iou_threshold: float
+        :param max_age: (Optional) The number of keyframes in a row a track
+            can go undetected before it's dropped. Tracks are only shown
+            on frames following a keyframe where they were detected, but
+            are kept around to be matched again in case the detector missed
+            them. Defaults to 1.
+        :type max_age: int
+        :param smoothing: (Optional) How much of a track's previous
+            velocity to keep when updating it with a new detection, between
+            0 (only use the latest motion) and 1 (never update it).
+            Defaults to 0.5.
+        :type smoothing: float
+
+        **Example**::
+
+            >>> from detecto.core import Model
+            >>> from detecto.tracking import Tracker
+
+            >>> model = Model.load('model_weights.pth', ['car', 'truck'])
+            >>> tracker = Tracker()
+            >>> for i, frame in enumerate(frames):
+            >>>     if i % 5 == 0:
+            >>>         labels, boxes, scores, ids = tracker.update(*model.predict(frame))
+            >>>     else:
+            >>>         labels, boxes, scores, ids = tracker.predict()
+        """
+
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.smoothing = smoothing
+
+        self._next_id = 0
+        self._labels = []
+        self._ids = torch.empty(0, dtype=torch.int64)
+        self._boxes = torch.empty(0, 4)
+        self._velocities = torch.empty(0, 4)
+        self._scores = torch.empty(0)
+        # The box of each track's last detection and how many frames ago it was
+        self._detected_boxes = torch.empty(0, 4)
+        self._frames_since_detected = torch.empty(0)
+        # The number of keyframes in a row each track has gone undetected
+        self._ages = torch.empty(0, dtype=torch.int64)
+
+    def update(self, labels, boxes, scores):
+        """Moves the tracks onto the next frame, which is a keyframe, and
+        matches them with the predictions on it. Unmatched predictions
+        start new tracks.
+
+        :param labels: The labels of the predictions, as a list or a
+            tensor of label ids.
+        :type labels: list or torch.Tensor
+        :param boxes: A tensor of size [N, 4] containing the boxes of the
+            predictions.
+        :type boxes: torch.Tensor
+        :param scores: A tensor of size N containing the scores of the
+            predictions.
+        :type scores: torch.Tensor
+        :return: A tuple of the labels, boxes, and scores of the tracks
+            detected on this frame, plus a tensor of their IDs. Tracks are
+            always returned in the order they were started in.
+        :rtype: tuple
+        """
+
+        labels = labels.tolist() if isinstance(labels, torch.Tensor) else list(labels)
+        boxes = boxes.float().reshape(-1, 4)
+        self._step()
+
+        detections, tracks = self._match(labels, boxes)
+        detected = torch.zeros(len(labels), dtype=torch.bool)
+        detected[detections] = True
+
+        # Update the matched tracks' boxes and velocities
+        motion = (boxes[detections] - self._detected_boxes[tracks]) / self._frames_since_detected[tracks, None]
+        self._velocities[tracks] = self.smoothing * self._velocities[tracks] + (1 - self.smoothing) * motion
+        self._boxes[tracks] = boxes[detections]
+        self._scores[tracks] = scores[detections]
+        self._detected_boxes[tracks] = boxes[detections]
+        self._frames_since_detected[tracks] = 0
+        self._ages += 1
+        self._ages[tracks] = 0
+
+        # Drop tracks that have been missing for too long
+        keep = self._ages <= self.max_age
+        self._filter(keep)
+
+        # Start a track for each unmatched detection
+        new = ~detected
+        num_new = int(new.sum())
+        self._labels += [label for label, is_new in zip(labels, new.tolist()) if is_new]
+        self._ids = torch.cat([self._ids, torch.arange(self._next_id, self._next_id + num_new)])
+        self._boxes = torch.cat([self._boxes, boxes[new]])
+        self._velocities = torch.cat([self._velocities, torch.zeros(num_new, 4)])
+        self._scores = torch.cat([self._scores, scores[new]])
+        self._detected_boxes = torch.cat([self._detected_boxes, boxes[new]])
+        self._frames_since_detected = torch.cat([self._frames_since_detected, torch.zeros(num_new)])
+        self._ages = torch.cat([self._ages, torch.zeros(num_new, dtype=torch.int64)])
+        self._next_id += num_new
+
+        return self._visible_tracks()
+
+    def predict(self):
+        """Moves the tracks onto the next frame, which isn't a keyframe,
+        by predicting where they are based on their velocities.
+
+        :return: A tuple of the labels, boxes, and scores of the tracks
+            detected on the last keyframe, plus a tensor of their IDs.
+        :rtype: tuple
+        """
+
+        self._step()
+        return self._visible_tracks()
+
+    def hold(self):
+        """Moves the tracks onto the next frame, on which nothing moved
+        since the last keyframe, e.g. because a motion check found the
+        frame unchanged. Each track is put back where it was last detected
+        and stopped, instead of being moved along its velocity.
+
+        :return: A tuple of the labels, boxes, and scores of the tracks
+            detected on the last keyframe, plus a tensor of their IDs.
+        :rtype: tuple
+        """
+
+        self._boxes = self._detected_boxes.clone()
+        self._velocities.zero_()
+        self._frames_since_detected += 1
+        return self._visible_tracks()
+
+    # Moves each track along its velocity by one frame
+    def _step(self):
+        self._boxes += self._velocities
+        self._frames_since_detected += 1
+
+    # Greedily matches detections and tracks of the same label in order of
+    # decreasing IoU. Returns the indices of the matched detections and tracks
+    def _match(self, labels, boxes):
+        ious = box_iou(boxes, self._boxes)
+        same_label = torch.tensor([[label == track_label for track_label in self._labels] for label in labels],
+                                  dtype=torch.bool).reshape(ious.shape)
+
+        detections, tracks = [], []
+        candidates = ((ious >= self.iou_threshold) & same_label).nonzero()
+        order = torch.argsort(ious[candidates[:, 0], candidates[:, 1]], descending=True)
+        for detection, track in candidates[order].tolist():
+            if detection not in detections and track not in tracks:
+                detections.append(detection)
+                tracks.append(track)
+
+        return torch.tensor(detections, dtype=torch.int64), torch.tensor(tracks, dtype=torch.int64)
+
+    # Keeps only the tracks marked in the given boolean mask
+    def _filter(self, keep):
+        self._labels = [label for label, kept in zip(self._labels, keep.tolist()) if kept]
+        self._ids = self._ids[keep]
+        self._boxes = self._boxes[keep]
+        self._velocities = self._velocities[keep]
+        self._scores = self._scores[keep]
+        self._detected_boxes = self._detected_boxes[keep]
+        self._frames_since_detected = self._frames_since_detected[keep]
+        self._ages = self._ages[keep]
+
+    # Returns the tracks detected on the last keyframe
+    def _visible_tracks(self):
+        visible = self._ages == 0
+        labels = [label for label, is_visible in zip(self._labels, visible.tolist()) if is_visible]
+        return labels, self._boxes[visible], self._scores[visible], self._ids[visible]
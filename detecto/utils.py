@@ -1,9 +1,14 @@
 import cv2
+import math
 import os
 import pandas as pd
+import queue
+import threading
 import torch
 import xml.etree.ElementTree as ET
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from glob import glob
 from torchvision import transforms
 
@@ -39,15 +44,17 @@ def filter_top_predictions(labels, boxes, scores):
     :meth:`detecto.core.Model.predict` to this function produces the same
     results as a direct call to :meth:`detecto.core.Model.predict_top`.
 
-    :param labels: A list containing the string labels.
-    :type labels: list
+    :param labels: A list containing the string labels, or a tensor
+        containing integer label ids.
+    :type labels: list or torch.Tensor
     :param boxes: A tensor of size [N, 4] containing the N box coordinates.
     :type boxes: torch.Tensor
     :param scores: A tensor containing the score for each prediction.
     :type scores: torch.Tensor
     :return: Returns a tuple of the given labels, boxes, and scores, except
         with only the top scoring prediction of each unique label kept in;
-        all other predictions are filtered out.
+        all other predictions are filtered out. The kept predictions are
+        sorted by decreasing score, and ties go to the earliest one.
     :rtype: tuple
 
     **Example**::
@@ -64,21 +71,100 @@ def filter_top_predictions(labels, boxes, scores):
         [ 875.3470,  412.1762,  949.5915,  793.3424]]), tensor([0.9397, 0.8686]))
     """
 
-    filtered_labels = []
-    filtered_boxes = []
-    filtered_scores = []
-    # Loop through each unique label
-    for label in set(labels):
-        # Get first index of label, which is also its highest scoring occurrence
-        index = labels.index(label)
+    return filter_top_predictions_batch([(labels, boxes, scores)])[0]
 
-        filtered_labels.append(label)
-        filtered_boxes.append(boxes[index])
-        filtered_scores.append(scores[index])
 
-    if len(filtered_labels) == 0:
-        return filtered_labels, torch.empty(0, 4), torch.tensor(filtered_scores)
-    return filtered_labels, torch.stack(filtered_boxes), torch.tensor(filtered_scores)
+def filter_top_predictions_batch(predictions):
+    """Same as :func:`detecto.utils.filter_top_predictions`, but filters
+    the predictions of many images at once, which is much faster than
+    filtering them one by one.
+
+    :param predictions: A list of (labels, boxes, scores) tuples, such as
+        the output of :meth:`detecto.core.Model.predict` on a list of
+        images. Either all or none of the labels should be tensors of
+        integer label ids.
+    :type predictions: list
+    :return: A list of tuples, each containing the top scoring
+        predictions of each unique label in the corresponding image.
+    :rtype: list
+
+    **Example**::
+
+        >>> from detecto.core import Model
+        >>> from detecto.utils import read_image, filter_top_predictions_batch
+
+        >>> model = Model.load('model_weights.pth', ['label1', 'label2'])
+        >>> images = [read_image('image0.jpg'), read_image('image1.jpg')]
+        >>> top_preds = filter_top_predictions_batch(model.predict(images))
+        >>> [labels for labels, boxes, scores in top_preds]
+        [['label2', 'label1'], ['label1']]
+    """
+
+    if len(predictions) == 0:
+        return []
+
+    counts = torch.tensor([len(pred[2]) for pred in predictions])
+    boxes = torch.cat([pred[1].reshape(-1, 4) for pred in predictions])
+    scores = torch.cat([torch.as_tensor(pred[2]) for pred in predictions])
+
+    tensor_labels = isinstance(predictions[0][0], torch.Tensor)
+    if tensor_labels:
+        labels = torch.cat([pred[0] for pred in predictions])
+        label_ids = labels.long()
+    else:
+        label_ids, names = _encode_labels([label for pred in predictions for label in pred[0]])
+
+    # Gives each (image, label) pair its own key, so a single pass
+    # finds the top prediction of every label in every image
+    image_ids = torch.repeat_interleave(torch.arange(len(predictions)), counts)
+    num_labels = int(label_ids.max()) + 1 if len(label_ids) > 0 else 1
+    keep = _get_top_indices(image_ids * num_labels + label_ids, scores)
+    # Regroups the kept predictions by image, still sorted by score
+    keep = keep[_stable_argsort(image_ids[keep])]
+
+    results = []
+    for indices in keep.split(torch.bincount(image_ids[keep], minlength=len(predictions)).tolist()):
+        if tensor_labels:
+            kept_labels = labels[indices]
+        else:
+            kept_labels = [names[label_id] for label_id in label_ids[indices].tolist()]
+        results.append((kept_labels, boxes[indices], scores[indices]))
+
+    return results
+
+
+# Maps a list of string labels to a tensor of integer ids
+# and the list of unique labels those ids index into
+def _encode_labels(labels):
+    mapping = {}
+    label_ids = [mapping.setdefault(label, len(mapping)) for label in labels]
+    return torch.tensor(label_ids, dtype=torch.int64), list(mapping)
+
+
+# Returns the index of the top scoring element of each unique key, sorted
+# by decreasing score. Ties go to the element that appears first
+def _get_top_indices(keys, scores):
+    if len(scores) == 0:
+        return torch.empty(0, dtype=torch.int64)
+
+    # Ranks the scores from highest to lowest, equal scores sharing a rank
+    _, ranks = torch.unique(-scores, return_inverse=True)
+    order = _stable_argsort(ranks)
+
+    # Groups the sorted elements by key; each group starts with its top element
+    _, key_ids = torch.unique(keys[order], return_inverse=True)
+    grouped = _stable_argsort(key_ids)
+    _, counts = torch.unique_consecutive(key_ids[grouped], return_counts=True)
+    first = grouped[counts.cumsum(0) - counts]
+    return order[first.sort()[0]]
+
+
+# Argsorts a tensor of non-negative integers, keeping equal values in their
+# original order. Older versions of PyTorch have no stable sort, so each
+# value is combined with its position into a unique key instead
+def _stable_argsort(values):
+    positions = torch.arange(len(values))
+    return torch.argsort(values * len(values) + positions)
 
 
 def normalize_transform():
@@ -176,9 +262,11 @@ def reverse_normalize(image):
     return reverse(image)
 
 
-def split_video(video_file, output_folder, prefix='frame', step_size=1):
+def split_video(video_file, output_folder, prefix='frame', step_size=1, fps=None, num_threads=4, num_workers=0):
     """Splits a video into individual frames and saves the JPG images to the
-    specified output folder.
+    specified output folder. Frames that aren't saved are skipped over
+    without being decoded, and the images are encoded and written by a
+    pool of threads.
 
     :param video_file: The path to the video file to split.
     :type video_file: str
@@ -192,12 +280,30 @@ def split_video(video_file, output_folder, prefix='frame', step_size=1):
         For example, if step_size == 3, it will save every third frame.
         Defaults to 1.
     :type step_size: int
+    :param fps: (Optional) If given, saves this many frames per second of
+        video instead, regardless of the video's own frame rate, and
+        ``step_size`` is ignored. Defaults to None.
+    :type fps: float or None
+    :param num_threads: (Optional) The number of threads with which to
+        write the images. Defaults to 4.
+    :type num_threads: int
+    :param num_workers: (Optional) If greater than 1, splits the video
+        into this many segments of consecutive frames and processes each
+        one in its own process, seeking straight to the segment's first
+        frame. Relies on the video reporting its frame count accurately.
+        Defaults to 0.
+    :type num_workers: int
+    :return: The number of frames saved.
+    :rtype: int
 
     **Example**::
 
         >>> from detecto.utils import split_video
 
         >>> split_video('video.mp4', 'frames/', step_size=4)
+
+        >>> # Save two frames per second of a long video using 4 processes
+        >>> split_video('video.mp4', 'frames/', fps=2, num_workers=4)
     """
 
     # Set step_size to minimum of 1
@@ -206,28 +312,80 @@ def split_video(video_file, output_folder, prefix='frame', step_size=1):
         step_size = 1
 
     video = cv2.VideoCapture(video_file)
+    video_fps = video.get(cv2.CAP_PROP_FPS)
+    num_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
 
-    count = 0
-    index = 0
-    # Loop through video frame by frame
-    while True:
-        ret, frame = video.read()
-        if not ret:
-            break
+    # The number of frames between each saved frame, which can be fractional
+    step = step_size
+    if fps is not None:
+        if fps <= 0 or video_fps <= 0:
+            raise ValueError(f'Cannot sample {fps} frames per second from a video at {video_fps} FPS')
+        step = max(video_fps / fps, 1)
 
-        # Save every step_size frames
-        if count % step_size == 0:
-            file_name = '{}{}.jpg'.format(prefix, index)
-            cv2.imwrite(os.path.join(output_folder, file_name), frame)
-            index += 1
+    num_threads = max(num_threads, 1)
+    if num_workers <= 1 or num_frames <= num_workers:
+        return _split_video_segment(video_file, output_folder, prefix, step, num_threads)
 
-        count += 1
+    # The last segment runs to the end of the video in case its frame count is off
+    bounds = [num_frames * i // num_workers for i in range(num_workers)] + [None]
+    with ProcessPoolExecutor(num_workers) as executor:
+        futures = [executor.submit(_split_video_segment, video_file, output_folder, prefix, step, num_threads,
+                                   bounds[i], bounds[i + 1]) for i in range(num_workers)]
+        return sum(future.result() for future in futures)
+
+
+# Returns the position of the index-th frame to save when saving one every step frames
+def _get_frame_position(index, step):
+    return int(index * step + 0.5)
+
+
+# Saves the frames of a video from frame start up to frame end (or the end
+# of the video) that fall on the given step, skipping over the rest without
+# decoding them. Images are named after their index among all saved frames
+# and written by a pool of threads. Returns the number of frames saved
+def _split_video_segment(video_file, output_folder, prefix, step, num_threads, start=0, end=None):
+    video = cv2.VideoCapture(video_file)
+    if start > 0:
+        video.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    # Find the first frame to save in this segment
+    index = max(math.ceil((start - 0.5) / step), 0)
+    while _get_frame_position(index, step) < start:
+        index += 1
+
+    position, num_saved = start, 0
+    pending = deque()
+    with ThreadPoolExecutor(num_threads) as executor:
+        while end is None or position < end:
+            if position != _get_frame_position(index, step):
+                # Advances without decoding the frame
+                if not video.grab():
+                    break
+            else:
+                ret, frame = video.read()
+                if not ret:
+                    break
+
+                file_name = '{}{}.jpg'.format(prefix, index)
+                pending.append(executor.submit(cv2.imwrite, os.path.join(output_folder, file_name), frame))
+                index += 1
+                num_saved += 1
+
+                # Bound the number of decoded frames waiting to be written
+                if len(pending) > 2 * num_threads:
+                    pending.popleft().result()
+
+            position += 1
+
+        for future in pending:
+            future.result()
 
     video.release()
-    cv2.destroyAllWindows()
+    return num_saved
 
 
-def xml_to_csv(xml_folder, output_file=None):
+def xml_to_csv(xml_folder, output_file=None, num_workers=0, chunk_size=64, cache_file=None):
     """Converts a folder of XML label files into a pandas DataFrame and/or
     CSV file, which can then be used to create a :class:`detecto.core.Dataset`
     object. Each XML file should correspond to an image and contain the image
@@ -240,10 +398,31 @@ def xml_to_csv(xml_folder, output_file=None):
     :param xml_folder: The path to the folder containing the XML files.
     :type xml_folder: str
     :param output_file: (Optional) If given, saves a CSV file containing
-        the XML data in the file output_file. If None, does not save to
-        any file. Defaults to None.
+        the XML data in the file output_file. If the file name ends in
+        .parquet or .feather, saves the data in that columnar format
+        instead, which is much faster and smaller to load back into a
+        :class:`detecto.core.Dataset` (requires `pyarrow
+        <https://arrow.apache.org/docs/python/>`_). If None, does not save
+        to any file. Defaults to None.
     :type output_file: str or None
-    :return: A pandas DataFrame containing the XML data.
+    :param num_workers: (Optional) The number of processes with which to
+        parse the XML files in parallel. If 0, parses them in the main
+        process. Defaults to 0.
+    :type num_workers: int
+    :param chunk_size: (Optional) The number of XML files sent to a worker
+        process at a time when ``num_workers`` is greater than 0. Defaults
+        to 64.
+    :type chunk_size: int
+    :param cache_file: (Optional) If given, the path to a file in which to
+        keep the parsed data along with a manifest of each XML file's
+        modification time and size. On later calls, only XML files that
+        were added or changed since are parsed again, and every XML file
+        keeps the same image_id for as long as it exists. Defaults to None,
+        in which case every XML file is parsed on each call.
+    :type cache_file: str or None
+    :return: A pandas DataFrame containing the XML data. The ``filename``
+        and ``class`` columns are categorical and all other columns are
+        32-bit integers.
     :rtype: pandas.DataFrame
 
     **Example**::
@@ -252,44 +431,243 @@ def xml_to_csv(xml_folder, output_file=None):
 
         >>> # Saves data to a file called labels.csv
         >>> xml_to_csv('xml_labels/', 'labels.csv')
+        >>> # Saves data to a columnar Parquet file
+        >>> xml_to_csv('xml_labels/', 'labels.parquet')
         >>> # Returns a pandas DataFrame of the data
         >>> df = xml_to_csv('xml_labels/')
+        >>> # Parses with 8 processes, only reparsing changed files on later calls
+        >>> df = xml_to_csv('xml_labels/', num_workers=8, cache_file='labels.pkl')
     """
 
-    xml_list = []
-    image_id = 0
-    # Loop through every XML file
-    for xml_file in glob(xml_folder + '/*.xml'):
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        filename = root.find('filename').text
-        size = root.find('size')
-        width = int(size.find('width').text)
-        height = int(size.find('height').text)
-
-        # Each object represents each actual image label
-        for member in root.findall('object'):
-            box = member.find('bndbox')
-            label = member.find('name').text
-
-            # Add image file name, image size, label, and box coordinates to CSV file
-            row = (filename, width, height, label, int(float(box.find('xmin').text)),
-                   int(float(box.find('ymin').text)), int(float(box.find('xmax').text)), int(float(box.find('ymax').text)), image_id)
-            xml_list.append(row)
-        
-        image_id += 1
-
-    # Save as a CSV file
     column_names = ['filename', 'width', 'height', 'class', 'xmin', 'ymin', 'xmax', 'ymax', 'image_id']
+    xml_files = glob(xml_folder + '/*.xml')
+
+    # Maps each XML file to its ((modification time, size), image_id)
+    manifest = {}
+    cached_df = None
+    next_id = 0
+    if cache_file is not None and os.path.isfile(cache_file):
+        cache = pd.read_pickle(cache_file)
+        manifest, cached_df, next_id = cache['manifest'], cache['labels'], cache['next_id']
+
+    # Only parse the XML files that are new or have changed since they were cached
+    updated_manifest = {}
+    kept_ids = []
+    changed_files = []
+    for xml_file in xml_files:
+        signature = None
+        if cache_file is not None:
+            stat = os.stat(xml_file)
+            signature = (stat.st_mtime_ns, stat.st_size)
+
+        if xml_file in manifest and manifest[xml_file][0] == signature:
+            kept_ids.append(manifest[xml_file][1])
+            updated_manifest[xml_file] = manifest[xml_file]
+            continue
+
+        # Changed files keep their image_id; new ones get the next unused one
+        if xml_file in manifest:
+            image_id = manifest[xml_file][1]
+        else:
+            image_id = next_id
+            next_id += 1
+        updated_manifest[xml_file] = (signature, image_id)
+        changed_files.append(xml_file)
+
+    xml_list = []
+    for xml_file, rows in zip(changed_files, _parse_xml_files(changed_files, num_workers, chunk_size)):
+        image_id = updated_manifest[xml_file][1]
+        # Add image file name, image size, label, and box coordinates to CSV file
+        xml_list.extend(row + (image_id,) for row in rows)
+
     xml_df = pd.DataFrame(xml_list, columns=column_names)
 
+    # Merge in the rows of unchanged files from the cache
+    if len(kept_ids) > 0:
+        kept_df = cached_df[cached_df['image_id'].isin(kept_ids)]
+        xml_df = pd.concat([kept_df, xml_df]) if len(xml_df) > 0 else kept_df
+        xml_df = xml_df.sort_values('image_id', kind='stable').reset_index(drop=True)
+
+    xml_df = xml_df.astype(_LABEL_DTYPES)
+
+    if cache_file is not None:
+        pd.to_pickle({'manifest': updated_manifest, 'labels': xml_df, 'next_id': next_id}, cache_file)
+
+    # Save as a CSV or columnar file
     if output_file is not None:
-        xml_df.to_csv(output_file, index=None)
+        _write_labels(xml_df, output_file)
 
     return xml_df
 
 
+# Compact column types for label data
+_LABEL_DTYPES = {
+    'filename': 'category',
+    'width': 'int32',
+    'height': 'int32',
+    'class': 'category',
+    'xmin': 'int32',
+    'ymin': 'int32',
+    'xmax': 'int32',
+    'ymax': 'int32',
+    'image_id': 'int32',
+}
+
+# File extensions of the supported columnar label formats
+_PARQUET_EXTENSIONS = ('.parquet', '.pq')
+_FEATHER_EXTENSIONS = ('.feather',)
+
+
+# Reads label data from a CSV, Parquet or Feather file, based on its extension
+def _read_labels(file):
+    extension = os.path.splitext(file)[1].lower()
+    if extension in _PARQUET_EXTENSIONS:
+        df = pd.read_parquet(file)
+    elif extension in _FEATHER_EXTENSIONS:
+        df = pd.read_feather(file)
+    else:
+        # Parse the string columns straight into categories; the numeric
+        # ones are converted below in case they were written as floats
+        df = pd.read_csv(file, dtype={k: v for k, v in _LABEL_DTYPES.items() if v == 'category'})
+
+    return df.astype({k: v for k, v in _LABEL_DTYPES.items() if k in df.columns})
+
+
+# Writes label data to a CSV, Parquet or Feather file, based on its extension
+def _write_labels(df, file):
+    extension = os.path.splitext(file)[1].lower()
+    if extension in _PARQUET_EXTENSIONS:
+        df.to_parquet(file, index=False)
+    elif extension in _FEATHER_EXTENSIONS:
+        df.reset_index(drop=True).to_feather(file)
+    else:
+        df.to_csv(file, index=None)
+
+
+# Parses each XML file into a list of (filename, width, height, label,
+# xmin, ymin, xmax, ymax) rows, one per object, spreading chunks of the
+# files across num_workers processes if num_workers > 0
+def _parse_xml_files(xml_files, num_workers, chunk_size):
+    if num_workers <= 0 or len(xml_files) <= 1:
+        return [_parse_xml(xml_file) for xml_file in xml_files]
+
+    with ProcessPoolExecutor(num_workers) as executor:
+        return list(executor.map(_parse_xml, xml_files, chunksize=chunk_size))
+
+
+def _parse_xml(xml_file):
+    tree = ET.parse(xml_file)
+    root = tree.getroot()
+
+    filename = root.find('filename').text
+    size = root.find('size')
+    width = int(size.find('width').text)
+    height = int(size.find('height').text)
+
+    # Each object represents each actual image label
+    rows = []
+    for member in root.findall('object'):
+        box = member.find('bndbox')
+        label = member.find('name').text
+
+        rows.append((filename, width, height, label, int(float(box.find('xmin').text)),
+                     int(float(box.find('ymin').text)), int(float(box.find('xmax').text)),
+                     int(float(box.find('ymax').text))))
+
+    return rows
+
+
 # Checks whether a variable is a list or tuple only
 def _is_iterable(variable):
     return isinstance(variable, list) or isinstance(variable, tuple)
+
+
+# Returns the height / width ratio of an image given as a NumPy array in
+# (H, W, C) format, a torch.Tensor in (C, H, W) format or a PIL image
+def _get_aspect_ratio(image):
+    if isinstance(image, torch.Tensor):
+        height, width = image.shape[-2:]
+    elif hasattr(image, 'shape'):
+        height, width = image.shape[:2]
+    else:
+        width, height = image.size
+    return height / width
+
+
+# Marks the end of the items flowing through a pipeline
+_PIPELINE_DONE = object()
+
+
+# Wraps an exception raised in one of the stages of a pipeline
+class _PipelineError:
+
+    def __init__(self, error):
+        self.error = error
+
+
+# Runs each function in stages on its own thread, feeding the items from
+# the given iterable through all of them in order with bounded queues in
+# between, so that each stage can work on the next item while the later
+# stages are busy. Yields the outputs of the last stage in the same order
+# as the items. Exceptions raised in any stage are re-raised to the caller.
+def _run_pipeline(items, stages, queue_size=2):
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+
+    # Puts to and gets from a queue, giving up once the pipeline is stopped
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _PIPELINE_DONE
+
+    def inputs(index):
+        if index == 0:
+            yield from items
+            return
+
+        while True:
+            item = get(queues[index - 1])
+            if item is _PIPELINE_DONE:
+                return
+            yield item
+
+    def run(index):
+        try:
+            for item in inputs(index):
+                # Pass errors from earlier stages straight through
+                if not isinstance(item, _PipelineError):
+                    item = stages[index](item)
+                if not put(queues[index], item) or isinstance(item, _PipelineError):
+                    return
+        except BaseException as e:
+            put(queues[index], _PipelineError(e))
+            return
+        put(queues[index], _PIPELINE_DONE)
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(len(stages))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _PIPELINE_DONE:
+                return
+            if isinstance(item, _PipelineError):
+                raise item.error
+            yield item
+    finally:
+        # Also stops the threads if the caller stops iterating early
+        stop.set()
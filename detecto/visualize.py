@@ -1,13 +1,22 @@
 import cv2
+import json
 import matplotlib.patches as patches
 import matplotlib.pyplot as plt
+import numpy as np
+import os
+import pandas as pd
+import time
 import torch
 
-from detecto.utils import reverse_normalize, normalize_transform, _is_iterable
+from contextlib import contextmanager
+from detecto.tracking import Tracker
+from detecto.utils import reverse_normalize, _is_iterable, _run_pipeline, _PARQUET_EXTENSIONS
 from torchvision import transforms
+from torchvision.models.detection.transform import GeneralizedRCNNTransform
 
 
-def detect_live(model, score_filter=0.6):
+def detect_live(model, score_filter=0.6, scaled_size=800, keyframe_interval=1, scene_threshold=None,
+                motion_threshold=None):
     """Displays in a window the given model's predictions on the current
     computer's live webcam feed. To stop the webcam, press 'q' or the ESC
     key. Note that if the given model is not running on a GPU, the webcam
@@ -20,6 +29,24 @@ def detect_live(model, score_filter=0.6):
     :param score_filter: (Optional) Minimum score required to show a
         prediction. Defaults to 0.6.
     :type score_filter: float
+    :param scaled_size: (Optional) If given, frames are scaled down so
+        that their shorter side is this size before being fed into the
+        model. See :func:`detecto.visualize.detect_video`. Defaults to 800.
+    :type scaled_size: int or None
+    :param keyframe_interval: (Optional) Only run the model on every
+        ``keyframe_interval``-th frame and track the detected objects
+        in between. See :func:`detecto.visualize.detect_video`. Defaults
+        to 1.
+    :type keyframe_interval: int
+    :param scene_threshold: (Optional) Also run the model on frames that
+        changed by more than this amount since the last one it ran on.
+        See :func:`detecto.visualize.detect_video`. Defaults to None.
+    :type scene_threshold: float or None
+    :param motion_threshold: (Optional) Skip running the model on frames
+        that barely changed since the last one it ran on, reusing its
+        previous predictions instead. See
+        :func:`detecto.visualize.detect_video`. Defaults to None.
+    :type motion_threshold: float or None
 
     **Example**::
 
@@ -37,36 +64,38 @@ def detect_live(model, score_filter=0.6):
         print('No webcam available.')
         return
 
-    while True:
-        ret, frame = video.read()
-        if not ret:
-            break
+    selector = _KeyframeSelector(keyframe_interval, scene_threshold, motion_threshold)
+    tracker = Tracker() if selector.tracks else _HoldTracker()
 
-        labels, boxes, scores = model.predict(frame)
+    with _scaled_model(model, scaled_size):
+        while True:
+            ret, frame = video.read()
+            if not ret:
+                break
 
-        # Plot each box with its label and score
-        for i in range(boxes.shape[0]):
-            if scores[i] < score_filter:
-                continue
+            predictions = None
+            decision = selector.select(frame)
+            if decision == _KeyframeSelector.KEYFRAME:
+                image, scale = _prepare_frame(frame, scaled_size)
+                labels, boxes, scores = model.predict(image, score_threshold=score_filter)
+                predictions = labels, boxes * scale, scores
 
-            box = boxes[i]
-            cv2.rectangle(frame, (int(box[0]), int(box[1])), (int(box[2]), int(box[3])), (255, 0, 0), 3)
-            if labels:
-                cv2.putText(frame, '{}: {}'.format(labels[i], round(scores[i].item(), 2)), (int(box[0]), int(box[1] - 10)),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 3)
+            # Plot each box with its label and score
+            _draw_predictions(frame, *_track_predictions(tracker, decision, predictions))
 
-        cv2.imshow('Detecto', frame)
+            cv2.imshow('Detecto', frame)
 
-        # If the 'q' or ESC key is pressed, break from the loop
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q') or key == 27:
-            break
+            # If the 'q' or ESC key is pressed, break from the loop
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q') or key == 27:
+                break
 
     cv2.destroyWindow('Detecto')
     video.release()
 
 
-def detect_video(model, input_file, output_file, fps=30, score_filter=0.6):
+def detect_video(model, input_file, output_file, fps=30, score_filter=0.6, batch_size=4, queue_size=4,
+                 scaled_size=800, keyframe_interval=1, scene_threshold=None, motion_threshold=None):
     """Takes in a video and produces an output video with object detection
     run on it (i.e. displays boxes around detected objects in real-time).
     Output videos should have the .avi file extension. Note: some apps,
@@ -74,6 +103,9 @@ def detect_video(model, input_file, output_file, fps=30, score_filter=0.6):
     output videos. It's recommended that you download and use
     `VLC <https://www.videolan.org/vlc/index.html>`_ if this occurs.
 
+    Decoding frames, running the model on them, drawing the boxes and
+    encoding the output each happen on their own thread, so the model
+    never sits idle waiting on the video's I/O and vice versa.
 
     :param model: The trained model with which to run object detection.
     :type model: detecto.core.Model
@@ -88,6 +120,49 @@ def detect_video(model, input_file, output_file, fps=30, score_filter=0.6):
     :param score_filter: (Optional) Minimum score required to show a
         prediction. Defaults to 0.6.
     :type score_filter: float
+    :param batch_size: (Optional) The number of frames to feed into the
+        model at once. Defaults to 4.
+    :type batch_size: int
+    :param queue_size: (Optional) The maximum number of batches waiting
+        between each thread, which bounds the memory used. Defaults to 4.
+    :type queue_size: int
+    :param scaled_size: (Optional) If given, frames are scaled down so
+        that their shorter side is this size before being fed into the
+        model, and the predicted boxes are scaled back up to match the
+        original frames. While the video is processed, the model is also
+        set to run at this size if its own ``min_size`` is larger, so that
+        smaller sizes cut its latency in proportion to the number of
+        pixels. Frames are never scaled up. Defaults to 800.
+    :type scaled_size: int or None
+    :param keyframe_interval: (Optional) Only run the model on every
+        ``keyframe_interval``-th frame (the keyframes), and fill in the
+        frames in between by tracking the objects detected on the
+        keyframes with a :class:`detecto.tracking.Tracker`. Each object
+        is then also labeled with its track ID. Defaults to 1, in which
+        case the model runs on every frame.
+    :type keyframe_interval: int
+    :param scene_threshold: (Optional) If given, also run the model on any
+        frame whose mean absolute difference from the last keyframe (on a
+        small grayscale version of both, scaled to between 0 and 1)
+        exceeds this value, so that sudden motion or scene cuts are
+        detected right away. Enables tracking like ``keyframe_interval``.
+        Defaults to None.
+    :type scene_threshold: float or None
+    :param motion_threshold: (Optional) If given, frames that the model
+        would otherwise run on are skipped if their difference from the
+        last frame it ran on (measured like for ``scene_threshold``) is
+        at most this value, and the previous predictions are reused
+        instead. When tracking, the tracks are also held where they were
+        last detected until the scene changes again. Meant for static
+        cameras, where most frames show the same scene; values around
+        0.01 ignore sensor noise and compression artifacts. Defaults to
+        None.
+    :type motion_threshold: float or None
+    :return: A dict with the number of ``frames`` processed, the number
+        of ``keyframes`` the model ran on, the number of forward passes
+        ``skipped`` because of ``motion_threshold``, the total number of
+        ``seconds`` taken, and the end-to-end ``fps``.
+    :rtype: dict
 
     **Example**::
 
@@ -95,9 +170,25 @@ def detect_video(model, input_file, output_file, fps=30, score_filter=0.6):
         >>> from detecto.visualize import detect_video
 
         >>> model = Model.load('model_weights.pth', ['tick', 'gate'])
-        >>> detect_video(model, 'input_vid.mp4', 'output_vid.avi', score_filter=0.7)
+        >>> stats = detect_video(model, 'input_vid.mp4', 'output_vid.avi', score_filter=0.7, batch_size=8)
+        >>> stats['fps']
+        21.4
+
+        >>> # Run the model on frames scaled down to 512 pixels
+        >>> fast_model = Model.load('model_weights.pth', ['tick', 'gate'], preset=Model.FAST)
+        >>> detect_video(fast_model, 'input_vid.mp4', 'output_vid.avi', scaled_size=512)
+
+        >>> # Only detect on every 5th frame or on scene changes, tracking in between
+        >>> detect_video(model, 'input_vid.mp4', 'output_vid.avi', keyframe_interval=5, scene_threshold=0.1)
+
+        >>> # Only run the model when something moves in front of a static camera
+        >>> stats = detect_video(model, 'camera.mp4', 'output_vid.avi', motion_threshold=0.01)
+        >>> stats['skipped']
+        8210
     """
 
+    start = time.perf_counter()
+
     # Read in the video
     video = cv2.VideoCapture(input_file)
 
@@ -105,66 +196,423 @@ def detect_video(model, input_file, output_file, fps=30, score_filter=0.6):
     frame_width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
     frame_height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-    # Scale down frames when passing into model for faster speeds
-    scaled_size = 800
-    scale_down_factor = min(frame_height, frame_width) / scaled_size
-
     # The VideoWriter with which we'll write our video with the boxes and labels
     # Parameters: filename, fourcc, fps, frame_size
     out = cv2.VideoWriter(output_file, cv2.VideoWriter_fourcc(*'DIVX'), fps, (frame_width, frame_height))
 
-    # Transform to apply on individual frames of the video
-    transform_frame = transforms.Compose([  # TODO Issue #16
-        transforms.ToPILImage(),
-        transforms.Resize(scaled_size),
-        transforms.ToTensor(),
-        normalize_transform(),
-    ])
-
-    # Loop through every frame of the video
-    while True:
-        ret, frame = video.read()
-        # Stop the loop when we're done with the video
-        if not ret:
-            break
-
-        # The transformed frame is what we'll feed into our model
-        # transformed_frame = transform_frame(frame)
-        transformed_frame = frame  # TODO: Issue #16
-        predictions = model.predict(transformed_frame)
-
-        # Add the top prediction of each class to the frame
-        for label, box, score in zip(*predictions):
-            if score < score_filter:
-                continue
-
-            # Since the predictions are for scaled down frames,
-            # we need to increase the box dimensions
-            # box *= scale_down_factor  # TODO Issue #16
-
-            # Create the box around each object detected
-            # Parameters: frame, (start_x, start_y), (end_x, end_y), (r, g, b), thickness
-            cv2.rectangle(frame, (box[0], box[1]), (box[2], box[3]), (255, 0, 0), 3)
-
-            # Write the label and score for the boxes
-            # Parameters: frame, text, (start_x, start_y), font, font scale, (r, g, b), thickness
-            cv2.putText(frame, '{}: {}'.format(label, round(score.item(), 2)), (box[0], box[1] - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 3)
-
-        # Write this frame to our video file
-        out.write(frame)
-
-        # If the 'q' key is pressed, break from the loop
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            break
-
-    # When finished, release the video capture and writer objects
-    video.release()
-    out.release()
+    selector = _KeyframeSelector(keyframe_interval, scene_threshold, motion_threshold)
+    tracker = Tracker() if selector.tracks else _HoldTracker()
+
+    def draw_batch(batch):
+        frames, predictions, batch_keyframes = batch
+        for frame, prediction in zip(frames, predictions):
+            _draw_predictions(frame, *prediction)
+        return frames, batch_keyframes
+
+    # The model runs at the size the frames are scaled to
+    with _scaled_model(model, scaled_size):
+        num_frames, num_keyframes = 0, 0
+        try:
+            # Writing happens on this thread, after drawing on another
+            batches = _predict_video(video, model, selector, tracker, score_filter, batch_size, queue_size, scaled_size,
+                                     stages=[draw_batch])
+            for frames, batch_keyframes in batches:
+                for frame in frames:
+                    # Write this frame to our video file
+                    out.write(frame)
+                num_frames += len(frames)
+                num_keyframes += batch_keyframes
+        finally:
+            # When finished, release the video capture and writer objects
+            video.release()
+            out.release()
+
+    seconds = time.perf_counter() - start
+    return {'frames': num_frames, 'keyframes': num_keyframes, 'skipped': selector.skipped, 'seconds': seconds,
+            'fps': num_frames / seconds if seconds > 0 else 0.0}
+
+
+def export_video_detections(model, input_file, output_file, score_filter=0.6, batch_size=4, queue_size=4,
+                            scaled_size=800, keyframe_interval=1, scene_threshold=None, motion_threshold=None):
+    """Runs object detection on a video like
+    :func:`detecto.visualize.detect_video`, except that instead of drawing
+    the predictions and encoding an output video, it streams them to a
+    file as the video is processed. Skipping drawing and encoding makes
+    this run at the model's speed, so it's a much cheaper way of indexing
+    long videos.
+
+    The output's format depends on its file extension. ``.jsonl`` files
+    get a JSON object per frame with its ``frame`` index, ``timestamp`` in
+    seconds, and the ``labels``, ``boxes``, and ``scores`` of its
+    predictions. ``.csv`` and Parquet (``.parquet`` or ``.pq``) files get
+    a row per prediction with the ``frame``, ``timestamp``, ``label``,
+    ``x1``, ``y1``, ``x2``, ``y2``, and ``score`` columns. Timestamps are
+    missing (``null`` in JSON) if the video doesn't report its frame
+    rate. When tracking,
+    each prediction's track ID is also included (as ``ids`` or
+    ``track_id``). Writing Parquet files requires pyarrow.
+
+    :param model: The trained model with which to run object detection.
+    :type model: detecto.core.Model
+    :param input_file: The path to the input video.
+    :type input_file: str
+    :param output_file: The path of the output file. Should have a
+        .jsonl, .csv, .parquet, or .pq file extension.
+    :type output_file: str
+    :param score_filter: (Optional) Minimum score required to keep a
+        prediction. Defaults to 0.6.
+    :type score_filter: float
+    :param batch_size: (Optional) The number of frames to feed into the
+        model at once. Defaults to 4.
+    :type batch_size: int
+    :param queue_size: (Optional) The maximum number of batches waiting
+        between each thread. Defaults to 4.
+    :type queue_size: int
+    :param scaled_size: (Optional) The size to scale the frames' shorter
+        side down to before feeding them into the model. See
+        :func:`detecto.visualize.detect_video`. Defaults to 800.
+    :type scaled_size: int or None
+    :param keyframe_interval: (Optional) Only run the model on every
+        ``keyframe_interval``-th frame, tracking objects in between. See
+        :func:`detecto.visualize.detect_video`. Defaults to 1.
+    :type keyframe_interval: int
+    :param scene_threshold: (Optional) Also run the model on frames that
+        changed by more than this amount since the last one it ran on.
+        See :func:`detecto.visualize.detect_video`. Defaults to None.
+    :type scene_threshold: float or None
+    :param motion_threshold: (Optional) Skip running the model on frames
+        that barely changed since the last one it ran on. See
+        :func:`detecto.visualize.detect_video`. Defaults to None.
+    :type motion_threshold: float or None
+    :return: The same stats as :func:`detecto.visualize.detect_video`,
+        plus the total number of ``detections`` written.
+    :rtype: dict
+
+    **Example**::
+
+        >>> import pandas as pd
+        >>> from detecto.core import Model
+        >>> from detecto.visualize import export_video_detections
+
+        >>> model = Model.load('model_weights.pth', ['car', 'person'])
+        >>> export_video_detections(model, 'footage.mp4', 'detections.parquet', batch_size=8)
+        >>> df = pd.read_parquet('detections.parquet')
+        >>> df[df['label'] == 'person']['timestamp'].min()
+        12.4
+    """
 
-    # Close all the frames
-    cv2.destroyAllWindows()
+    start = time.perf_counter()
+
+    selector = _KeyframeSelector(keyframe_interval, scene_threshold, motion_threshold)
+    tracker = Tracker() if selector.tracks else _HoldTracker()
+    writer = _DetectionWriter(output_file, selector.tracks)
+
+    video = cv2.VideoCapture(input_file)
+    video_fps = video.get(cv2.CAP_PROP_FPS)
+
+    with _scaled_model(model, scaled_size):
+        num_frames, num_keyframes = 0, 0
+        try:
+            batches = _predict_video(video, model, selector, tracker, score_filter, batch_size, queue_size, scaled_size,
+                                     keep_frames=False)
+            for frames, predictions, batch_keyframes in batches:
+                for prediction in predictions:
+                    timestamp = num_frames / video_fps if video_fps > 0 else None
+                    writer.write(num_frames, timestamp, *prediction)
+                    num_frames += 1
+                num_keyframes += batch_keyframes
+        finally:
+            video.release()
+            writer.close()
+
+    seconds = time.perf_counter() - start
+    return {'frames': num_frames, 'keyframes': num_keyframes, 'skipped': selector.skipped,
+            'detections': writer.num_detections, 'seconds': seconds, 'fps': num_frames / seconds if seconds > 0 else 0.0}
+
+
+# Runs the model on the frames of a video in batches, with reading (and
+# preparing frames for the model), predicting and tracking each happening
+# on their own thread, followed by the given extra stages. The tracking
+# stage outputs a (frames, predictions, number of keyframes) tuple for each
+# batch, with frames only kept if keep_frames is True and None otherwise
+def _predict_video(video, model, selector, tracker, score_filter, batch_size, queue_size, scaled_size,
+                   keep_frames=True, stages=()):
+    # Decodes the next batch of frames, or returns an empty list once done
+    def read_batch():
+        frames = []
+        while len(frames) < batch_size:
+            ret, frame = video.read()
+            if not ret:
+                break
+            frames.append(frame)
+        return frames
+
+    # Only the keyframes are prepared for and fed into the model
+    def prepare_batch(frames):
+        decisions = [selector.select(frame) for frame in frames]
+        prepared = [_prepare_frame(frame, scaled_size) for frame, decision in zip(frames, decisions)
+                    if decision == _KeyframeSelector.KEYFRAME]
+        if not keep_frames:
+            frames = [None] * len(frames)
+        return frames, decisions, prepared
+
+    def predict_batch(batch):
+        frames, decisions, prepared = batch
+        predictions = []
+        if prepared:
+            images, scales = zip(*prepared)
+            for scale, (labels, boxes, scores) in zip(scales, model.predict(list(images), score_threshold=score_filter)):
+                predictions.append((labels, boxes * scale, scores))
+        return frames, decisions, predictions
+
+    # Tracking depends on the previous frames, so this stage has to see them all in order
+    def track_batch(batch):
+        frames, decisions, predictions = batch
+        predictions = iter(predictions)
+        tracked = [_track_predictions(tracker, decision, next(predictions) if decision == _KeyframeSelector.KEYFRAME
+                                      else None) for decision in decisions]
+        return frames, tracked, decisions.count(_KeyframeSelector.KEYFRAME)
+
+    # Reading happens on the first stage's thread
+    stages = [prepare_batch, predict_batch, track_batch] + list(stages)
+    return _run_pipeline(iter(read_batch, []), stages, queue_size=queue_size)
+
+
+# Temporarily makes a torchvision model resize its inputs so that their
+# shorter side is scaled_size instead of its own (larger) min_size, so that
+# frames scaled down by _prepare_frame aren't scaled straight back up.
+# The longer side's limit is scaled down by the same factor
+@contextmanager
+def _scaled_model(model, scaled_size):
+    transform = getattr(model.get_internal_model(), 'transform', None)
+    if scaled_size is None or not isinstance(transform, GeneralizedRCNNTransform) or \
+            scaled_size >= transform.min_size[-1]:
+        yield
+        return
+
+    min_size, max_size = transform.min_size, transform.max_size
+    try:
+        transform.min_size = (scaled_size,)
+        transform.max_size = round(max_size * scaled_size / min_size[-1])
+        yield
+    finally:
+        transform.min_size, transform.max_size = min_size, max_size
+
+
+# Converts a BGR frame decoded by OpenCV into the RGB image the model
+# expects, first shrinking it with OpenCV so that its shorter side is
+# scaled_size (if given). Also returns the factors by which to scale
+# the boxes predicted on the image to map them back onto the frame
+def _prepare_frame(frame, scaled_size=None):
+    height, width = frame.shape[:2]
+    scale = torch.ones(4)
+
+    if scaled_size is not None and min(height, width) > scaled_size:
+        factor = scaled_size / min(height, width)
+        new_width, new_height = round(width * factor), round(height * factor)
+        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        scale = torch.tensor([width / new_width, height / new_height] * 2)
+
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), scale
+
+
+# Draws the boxes around each prediction and their labels, track IDs (if
+# given) and scores onto a frame
+def _draw_predictions(frame, labels, boxes, scores, ids=None):
+    ids = [None] * len(labels) if ids is None else ids.tolist()
+    for label, box, score, track_id in zip(labels, boxes.int().tolist(), scores.tolist(), ids):
+        # Create the box around each object detected
+        # Parameters: frame, (start_x, start_y), (end_x, end_y), (r, g, b), thickness
+        cv2.rectangle(frame, (box[0], box[1]), (box[2], box[3]), (255, 0, 0), 3)
+
+        # Write the label and score for the boxes
+        # Parameters: frame, text, (start_x, start_y), font, font scale, (r, g, b), thickness
+        text = '{}: {}'.format(label, round(score, 2)) if track_id is None else \
+            '{} #{}: {}'.format(label, track_id, round(score, 2))
+        cv2.putText(frame, text, (box[0], box[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 3)
+
+
+# Returns the predictions to draw on a frame given the selector's decision
+# for it and the model's predictions on it (None if it isn't a keyframe)
+def _track_predictions(tracker, decision, predictions=None):
+    if decision == _KeyframeSelector.KEYFRAME:
+        return tracker.update(*predictions)
+    if decision == _KeyframeSelector.HOLD:
+        return tracker.hold()
+    return tracker.predict()
+
+
+# Stands in for a Tracker when not tracking, simply holding
+# onto the last predictions until the next keyframe
+class _HoldTracker:
+
+    def __init__(self):
+        self._predictions = None
+
+    def update(self, labels, boxes, scores):
+        self._predictions = labels, boxes, scores
+        return self._predictions
+
+    def predict(self):
+        return self._predictions
+
+    def hold(self):
+        return self._predictions
+
+
+# Decides which frames of a video to run the model on: every
+# keyframe_interval-th frame, plus any frame that differs from the last
+# keyframe by more than scene_threshold (if given). If given a
+# motion_threshold, keyframes that differ from the last one by at most
+# that much are skipped instead, counting how many were skipped. Since
+# nothing moved on those, their tracks are held in place, not moved along
+class _KeyframeSelector:
+
+    # What to do with each frame: run the model on it, move the tracks
+    # along their velocities, or hold them where they were last detected
+    KEYFRAME = 'keyframe'
+    TRACK = 'track'
+    HOLD = 'hold'
+
+    def __init__(self, keyframe_interval=1, scene_threshold=None, motion_threshold=None):
+        self.keyframe_interval = keyframe_interval
+        self.scene_threshold = scene_threshold
+        self.motion_threshold = motion_threshold
+        # Whether the frames in between keyframes need to be tracked
+        self.tracks = keyframe_interval > 1 or scene_threshold is not None
+        self.skipped = 0
+
+        self._frames_since_keyframe = None
+        self._keyframe_thumbnail = None
+
+    def select(self, frame):
+        compares = self.scene_threshold is not None or self.motion_threshold is not None
+        thumbnail = _get_thumbnail(frame) if compares else None
+        difference = None
+        if thumbnail is not None and self._keyframe_thumbnail is not None:
+            difference = _get_difference(thumbnail, self._keyframe_thumbnail)
+
+        is_keyframe = self._frames_since_keyframe is None or \
+            self._frames_since_keyframe + 1 >= self.keyframe_interval
+        if not is_keyframe and self.scene_threshold is not None:
+            is_keyframe = difference > self.scene_threshold
+
+        # Nothing moved since the last keyframe, so its predictions still hold
+        if is_keyframe and self.motion_threshold is not None and difference is not None and \
+                difference <= self.motion_threshold:
+            self.skipped += 1
+            self._frames_since_keyframe += 1
+            return self.HOLD
+
+        if is_keyframe:
+            self._frames_since_keyframe = 0
+            self._keyframe_thumbnail = thumbnail
+            return self.KEYFRAME
+
+        self._frames_since_keyframe += 1
+        return self.TRACK
+
+
+# Returns a small grayscale version of a frame to cheaply compare frames with
+def _get_thumbnail(frame, width=64):
+    height = max(round(frame.shape[0] * width / frame.shape[1]), 1)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+
+# Returns the mean absolute difference between two thumbnails, from 0 to 1
+def _get_difference(thumbnail, other):
+    return cv2.absdiff(thumbnail, other).mean() / 255
+
+
+# Streams the predictions on each frame of a video to a JSON Lines, CSV or
+# Parquet file. The columnar formats get a row per prediction and are
+# written in chunks of rows, since writing them frame by frame is slow
+class _DetectionWriter:
+
+    _JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+    _CHUNK_SIZE = 65536
+
+    def __init__(self, file, tracks):
+        self.num_detections = 0
+        self._file = file
+        self._tracks = tracks
+        self._extension = os.path.splitext(file)[1].lower()
+
+        if self._extension in _PARQUET_EXTENSIONS:
+            import pyarrow.parquet  # Optional dependency, only needed here
+        elif self._extension not in self._JSONL_EXTENSIONS + ('.csv',):
+            raise ValueError(f'Invalid file extension {self._extension}. Please choose between .jsonl, .csv, '
+                             f'and {", ".join(_PARQUET_EXTENSIONS)}.')
+
+        self._json_file = open(file, 'w') if self._extension in self._JSONL_EXTENSIONS else None
+        self._parquet_writer = None
+        self._started = False
+        self._chunk = []
+        self._chunk_rows = 0
+
+    def write(self, frame, timestamp, labels, boxes, scores, ids=None):
+        self.num_detections += len(labels)
+
+        if self._json_file is not None:
+            record = {'frame': frame, 'timestamp': timestamp, 'labels': list(labels), 'boxes': boxes.tolist(),
+                      'scores': scores.tolist()}
+            if self._tracks:
+                record['ids'] = ids.tolist()
+            self._json_file.write(json.dumps(record) + '\n')
+            return
+
+        if len(labels) == 0:
+            return
+
+        boxes = boxes.numpy()
+        columns = {'frame': np.full(len(labels), frame),
+                   'timestamp': np.full(len(labels), np.nan if timestamp is None else timestamp),
+                   'label': list(labels)}
+        if self._tracks:
+            columns['track_id'] = ids.numpy()
+        columns.update({'x1': boxes[:, 0], 'y1': boxes[:, 1], 'x2': boxes[:, 2], 'y2': boxes[:, 3],
+                        'score': scores.numpy()})
+
+        self._chunk.append(pd.DataFrame(columns))
+        self._chunk_rows += len(labels)
+        if self._chunk_rows >= self._CHUNK_SIZE:
+            self._flush()
+
+    def close(self):
+        if self._json_file is not None:
+            self._json_file.close()
+            return
+
+        # Columnar files are written even if there weren't any predictions
+        if self._chunk or not self._started:
+            self._flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+    # Appends the buffered rows to the file
+    def _flush(self):
+        if self._chunk:
+            df = pd.concat(self._chunk, ignore_index=True)
+        else:
+            columns = ['frame', 'timestamp', 'label'] + (['track_id'] if self._tracks else []) + \
+                ['x1', 'y1', 'x2', 'y2', 'score']
+            df = pd.DataFrame({column: [] for column in columns})
+
+        if self._extension == '.csv':
+            df.to_csv(self._file, mode='a' if self._started else 'w', header=not self._started, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self._file, table.schema)
+            self._parquet_writer.write_table(table)
+
+        self._started = True
+        self._chunk = []
+        self._chunk_rows = 0
 
 
 def plot_prediction_grid(model, images, dim=None, figsize=None, score_filter=0.6):
@@ -15,16 +15,24 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     install_requires=[
         'matplotlib',
+        'numpy',
         'opencv-python',
         'pandas',
         'torch',
         'torchvision',
         'tqdm',
     ],
+    extras_require={
+        'onnx': ['onnx', 'onnxruntime'],
+        'parquet': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': ['detecto=detecto.cli:main'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )